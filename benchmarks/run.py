@@ -0,0 +1,252 @@
+"""runs the lillith benchmarks against a synthetic dump and a stub market
+
+    python3 benchmarks/run.py [-o results.json] [--compare old.json]
+
+The dump is built once per size and seed and kept in the work directory.
+Each benchmark is run several times and the best, median and mean times
+are recorded; with --compare, any benchmark whose best time is slower
+than the old results by more than --threshold is reported, and the exit
+status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import lillith
+import synthetic
+from stub_market import StubMarket
+
+BENCHMARKS = []
+
+def benchmark(f):
+    BENCHMARKS.append(f)
+    return f
+
+def timeit(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return {
+        'best': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'repeat': repeat,
+    }
+
+class Context:
+    """what every benchmark gets: the dump, the market, and a fixed
+    random sample of names and ids to work on"""
+    def __init__(self, dbpath, market, workdir, seed):
+        self.dbpath = dbpath
+        self.market = market
+        self.workdir = workdir
+        r = random.Random(seed)
+        self.initialize()
+        self.type_names = r.sample([t['name'] for t in lillith.ItemType.all().values('name')], 200)
+        self.type_ids = r.sample([t['id'] for t in lillith.ItemType.all().values('id')], 500)
+        self.system_ids = [s['id'] for s in lillith.SolarSystem.all().values('id')]
+        self.pairs = [tuple(r.sample(self.system_ids, 2)) for _ in range(100)]
+        self.region_ids = r.sample([g['id'] for g in lillith.Region.all().values('id')], 3)
+
+        # record the market benchmarks' requests into a local store
+        recordings = os.path.join(workdir, 'recordings-{}'.format(seed))
+        self.initialize(market=lillith.Recorder(lillith.HTTPBackend(), recordings))
+        lillith.ItemPrice.filter(type=self.type_ids, region=self.region_ids)
+        self.store = lillith.StoreBackend(os.path.join(workdir, 'market-{}.sqlite'.format(seed)))
+        self.store.import_recordings(recordings)
+        self.initialize()
+        self.check_transport()
+
+    def check_transport(self):
+        # sequential requests should all be recorded, and share one
+        # kept-alive connection
+        backend = lillith.HTTPBackend()
+        connections = self.market.connections
+        for t in self.type_ids[:4]:
+            self.initialize(market=backend)
+            lillith.ItemPrice.filter(type=t, region=self.region_ids[0])
+        self.initialize()
+        if len(backend.transport.history) != 4 or self.market.connections - connections != 1:
+            raise RuntimeError("market requests are not reusing connections: {} recorded, {} connections".format(len(backend.transport.history), self.market.connections - connections))
+
+    def initialize(self, **kwargs):
+        lillith.ItemPrice._url = self.market.url
+        kwargs.setdefault('cachedir', self.workdir)
+        lillith.initialize(self.dbpath, 'benchmark', **kwargs)
+
+def _python(code):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+
+@benchmark
+def import_lillith(ctx):
+    # a fresh interpreter, as short scripts like pricecheck.py pay for
+    _python('import lillith')
+
+@benchmark
+def import_star(ctx):
+    # what the shell does on startup
+    _python('from lillith import *')
+
+@benchmark
+def import_static(ctx):
+    # importing, then only touching static data
+    _python('import lillith; lillith.initialize({!r}, "benchmark"); lillith.ItemType(name={!r}).materials'.format(ctx.dbpath, ctx.type_names[0]))
+
+@benchmark
+def name_exact(ctx):
+    for name in ctx.type_names:
+        lillith.ItemType(name=name)
+
+@benchmark
+def name_search(ctx):
+    for name in ctx.type_names:
+        lillith.ItemType.search(name[:-2], limit=5)
+
+@benchmark
+def filter_types(ctx):
+    for t in lillith.ItemType.all():
+        t.name
+
+@benchmark
+def filter_systems(ctx):
+    for s in lillith.SolarSystem.all():
+        s.security
+
+@benchmark
+def jumps(ctx):
+    for i in ctx.system_ids[:500]:
+        lillith.SolarSystem.new_from_id(i).jumps
+
+@benchmark
+def route(ctx):
+    for a, b in ctx.pairs:
+        lillith.SolarSystem.new_from_id(a).route_to(lillith.SolarSystem.new_from_id(b))
+
+@benchmark
+def materials(ctx):
+    for t in lillith.ItemType.in_bulk(ctx.type_ids[:200]).values():
+        t.materials
+
+@benchmark
+def materials_prefetched(ctx):
+    for t in lillith.ItemType.filter(id=lillith.In(ctx.type_ids[:200])).prefetch_related('materials'):
+        t.materials
+
+@benchmark
+def itemprice_cold(ctx):
+    # a fresh configuration each time, so every price is fetched
+    ctx.initialize()
+    lillith.ItemPrice.filter(type=ctx.type_ids, region=ctx.region_ids)
+
+@benchmark
+def itemprice_warm(ctx):
+    lillith.ItemPrice.filter(type=ctx.type_ids, region=ctx.region_ids)
+
+@benchmark
+def itemprice_store(ctx):
+    # cold, but answered from the local store instead of the market
+    ctx.initialize(market=ctx.store)
+    lillith.ItemPrice.filter(type=ctx.type_ids, region=ctx.region_ids)
+
+@benchmark
+def hauling(ctx):
+    ctx.initialize(market=ctx.store)
+    scanner = lillith.HaulingScanner(types=ctx.type_ids)
+    scanner.scan(ctx.region_ids[:1], ctx.region_ids[1:], capacity=10000)
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    dbpath = os.path.join(args.workdir, 'synthetic-{}-{}-{}.sqlite'.format(args.systems, args.types, args.seed))
+    if not os.path.exists(dbpath):
+        synthetic.generate(dbpath, systems=args.systems, types=args.types, seed=args.seed)
+
+    results = {}
+    with StubMarket(latency=args.latency) as market:
+        ctx = Context(dbpath, market, args.workdir, args.seed)
+        for f in BENCHMARKS:
+            if args.only and f.__name__ not in args.only:
+                continue
+            # warm paths run after one untimed call
+            if f.__name__.endswith('_warm'):
+                f(ctx)
+            results[f.__name__] = timeit(lambda: f(ctx), args.repeat)
+            print('{:24} {:10.4f}s'.format(f.__name__, results[f.__name__]['best']), file=sys.stderr)
+        requests = market.requests
+        connections = market.connections
+
+    return {
+        'meta': {
+            'revision': _revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'systems': args.systems,
+            'types': args.types,
+            'seed': args.seed,
+            'latency': args.latency,
+            'market_requests': requests,
+            'market_connections': connections,
+        },
+        'results': results,
+    }
+
+def compare(old, new, threshold):
+    """returns the names of benchmarks that got slower than threshold"""
+    slower = []
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        ratio = result['best'] / old['results'][name]['best']
+        print('{:24} {:6.2f}x'.format(name, ratio), file=sys.stderr)
+        if ratio > 1 + threshold:
+            slower.append(name)
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run the lillith benchmarks")
+    parser.add_argument('-o', '--output', help="write results here, as JSON")
+    parser.add_argument('--compare', help="results from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'lillith-bench'))
+    parser.add_argument('--systems', type=int, default=5000)
+    parser.add_argument('--types', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0, help="seconds the stub market waits per request")
+    parser.add_argument('only', nargs='*', help="run only these benchmarks")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(json.load(f), results, args.threshold)
+        if slower:
+            print("slower: {}".format(', '.join(slower)), file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,87 @@
+"""a local stand-in for the eve-marketdata item_prices2.json API
+
+Prices are derived from a hash of (type, location, buy/sell), so every
+run sees the same data. Responses are gzipped when asked for, and the
+server speaks HTTP/1.1 so connections can be kept alive.
+"""
+
+import gzip
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+__all__ = ['StubMarket']
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.market.connections += 1
+
+    def do_GET(self):
+        market = self.server.market
+        market.requests += 1
+        if market.latency:
+            time.sleep(market.latency)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+        def ids(name):
+            return query[name][0].split(',') if name in query else []
+        types = ids('type_ids') or ['34']
+        if 'region_ids' in query:
+            locations = [('regionID', l) for l in ids('region_ids')]
+        else:
+            locations = [('solarsystemID', l) for l in ids('solarsystem_ids') or ['30000001']]
+        buysell = query.get('buysell', ['a'])[0]
+
+        rows = []
+        for t in types:
+            for field, l in locations:
+                for bs in 'bs':
+                    if buysell not in ('a', bs):
+                        continue
+                    r = random.Random('{}:{}:{}'.format(t, l, bs))
+                    price = r.lognormvariate(8, 2) * (0.9 if bs == 'b' else 1.1)
+                    rows.append({'row': {'buysell': bs, 'typeID': t, field: l, 'price': '{:.2f}'.format(price), 'updated': '2014-01-01 00:00:00'}})
+
+        body = json.dumps({'emd': {'version': 2, 'currentTime': '2014-01-01 00:00:00', 'result': rows}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubMarket:
+    """serves the stub API on localhost in a background thread; use as
+    a context manager, and point ItemPrice._url at self.url"""
+    def __init__(self, port=0, latency=0):
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.server.daemon_threads = True
+        self.server.market = self
+        self.url = 'http://127.0.0.1:{}/api/item_prices2.json'.format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    with StubMarket(port=8765) as market:
+        print(market.url)
+        threading.Event().wait()
@@ -0,0 +1,122 @@
+"""builds a synthetic static data dump with the tables lillith uses
+
+    python3 benchmarks/synthetic.py out.sqlite [--systems N] [--types N]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+
+# metres, the unit of the SDE coordinates
+LIGHT_YEAR = 9460730472580800
+
+SCHEMA = """
+create table invCategories (categoryID integer primary key, categoryName text, description text, iconID integer, published integer);
+create table invGroups (groupID integer primary key, categoryID integer, groupName text, description text, iconID integer, useBasePrice integer, allowManufacture integer, allowRecycler integer, anchored integer, anchorable integer, fittableNonSingleton integer, published integer);
+create table invTypes (typeID integer primary key, groupID integer, typeName text, description text, mass real, volume real, capacity real, portionSize integer, raceID integer, basePrice real, published integer, marketGroupID integer, chanceOfDuplicating real);
+create table invTypeMaterials (typeID integer, materialTypeID integer, quantity integer, primary key (typeID, materialTypeID));
+create table mapRegions (regionID integer primary key, regionName text, x real, y real, z real, xMin real, xMax real, yMin real, yMax real, zMin real, zMax real, factionID integer, radius real);
+create table mapConstellations (regionID integer, constellationID integer primary key, constellationName text, x real, y real, z real, xMin real, xMax real, yMin real, yMax real, zMin real, zMax real, factionID integer, radius real);
+create table mapSolarSystems (regionID integer, constellationID integer, solarSystemID integer primary key, solarSystemName text, x real, y real, z real, xMin real, xMax real, yMin real, yMax real, zMin real, zMax real, luminosity real, border integer, fringe integer, corridor integer, hub integer, international integer, regional integer, constellation integer, security real, factionID integer, radius real, sunTypeID integer, securityClass text);
+create table mapSolarSystemJumps (fromRegionID integer, fromConstellationID integer, fromSolarSystemID integer, toSolarSystemID integer, toConstellationID integer, toRegionID integer, primary key (fromSolarSystemID, toSolarSystemID));
+"""
+
+MINERALS = ['Tritanium', 'Pyerite', 'Mexallon', 'Isogen', 'Nocxium', 'Zydrine', 'Megacyte', 'Morphite']
+SYLLABLES = ['ja', 'ta', 'per', 'ama', 'rens', 'dod', 'ixi', 'ek', 'on', 'hek', 'or', 'vel', 'ash', 'uri', 'kal', 'zor']
+WORDS = ['Scraps', 'Frigate', 'Cruiser', 'Module', 'Ore', 'Charge', 'Drone', 'Blueprint', 'Armor', 'Shield', 'Booster', 'Compound']
+
+def _name(r, used):
+    while True:
+        name = ''.join(r.choice(SYLLABLES) for _ in range(r.randint(2, 4))).capitalize()
+        if r.random() < 0.3:
+            name += '-{}'.format(r.randint(1, 99))
+        if name not in used:
+            used.add(name)
+            return name
+
+def generate(path, systems=5000, types=20000, regions=60, constellations=6, materials=4, seed=1):
+    """writes a synthetic dump to path, replacing any file there"""
+    if os.path.exists(path):
+        os.remove(path)
+    r = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    conn.execute("insert into invCategories values (4, 'Material', 'Raw materials.', 0, 1)")
+    conn.execute("insert into invGroups values (18, 4, 'Mineral', 'Minerals.', 0, 1, 0, 0, 0, 0, 0, 1)")
+    for i, m in enumerate(MINERALS):
+        conn.execute("insert into invTypes values (?, 18, ?, ?, 1, 0.01, 0, 1, 0, 2, 1, 0, 0)", (34 + i, m, 'A mineral. ' * 20))
+
+    ngroups = max(1, types // 100)
+    for g in range(ngroups):
+        conn.execute("insert or ignore into invCategories values (?, ?, ?, 0, 1)", (10 + g % 20, 'Category {}'.format(g % 20), 'A category.'))
+        conn.execute("insert into invGroups values (?, ?, ?, ?, 0, 1, 1, 1, 0, 0, 0, 1)", (100 + g, 10 + g % 20, 'Group {}'.format(g), 'A group.'))
+    used = set(MINERALS)
+    for t in range(types):
+        typeid = 1000 + t
+        name = '{} {}'.format(_name(r, used), r.choice(WORDS))
+        conn.execute("insert into invTypes values (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, 1, 0, 0)",
+                     (typeid, 100 + t % ngroups, name, 'A long description. ' * r.randint(20, 100),
+                      r.uniform(1, 1e6), round(r.lognormvariate(1, 2), 2), r.uniform(0, 1000),
+                      r.choice([1, 1, 1, 100]), r.uniform(100, 1e8)))
+        for m in r.sample(range(34, 34 + len(MINERALS)), min(materials, len(MINERALS))):
+            conn.execute("insert into invTypeMaterials values (?, ?, ?)", (typeid, m, r.randint(1, 5000)))
+
+    used = set()
+    consts = []
+    for reg in range(regions):
+        regionid = 10000001 + reg
+        center = [r.uniform(-500, 500) * LIGHT_YEAR for _ in range(3)]
+        conn.execute("insert into mapRegions values (?, ?, ?, ?, ?, 0, 0, 0, 0, 0, 0, 0, 0)", [regionid, _name(r, used)] + center)
+        for c in range(constellations):
+            constid = 20000001 + reg * constellations + c
+            ccenter = [x + r.uniform(-30, 30) * LIGHT_YEAR for x in center]
+            conn.execute("insert into mapConstellations values (?, ?, ?, ?, ?, ?, 0, 0, 0, 0, 0, 0, 0, 0)", [regionid, constid, _name(r, used)] + ccenter)
+            consts.append((regionid, constid, ccenter))
+
+    bysystem = {}
+    members = {}
+    for s in range(systems):
+        systemid = 30000001 + s
+        regionid, constid, ccenter = consts[s % len(consts)]
+        pos = [x + r.uniform(-5, 5) * LIGHT_YEAR for x in ccenter]
+        security = round(r.uniform(-1, 1), 4)
+        conn.execute("insert into mapSolarSystems values (?, ?, ?, ?, ?, ?, ?, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, ?, 0, 0, 0, ?)",
+                     [regionid, constid, systemid, _name(r, used)] + pos + [security, r.choice(['A', 'B', 'C'])])
+        bysystem[systemid] = (regionid, constid)
+        members.setdefault(constid, []).append(systemid)
+
+    # a spanning tree inside each constellation, a few extra gates, and
+    # gates joining neighbouring constellations
+    edges = set()
+    for ids in members.values():
+        for i in range(1, len(ids)):
+            edges.add((ids[i], ids[r.randrange(i)]))
+        for _ in range(len(ids) // 4):
+            a, b = r.sample(ids, 2) if len(ids) > 1 else (ids[0], ids[0])
+            if a != b:
+                edges.add((a, b))
+    constids = sorted(members)
+    for i in range(1, len(constids)):
+        a = r.choice(members[constids[i]])
+        b = r.choice(members[constids[r.randrange(max(0, i - 3), i)]])
+        edges.add((a, b))
+    for a, b in edges:
+        for f, t in ((a, b), (b, a)):
+            conn.execute("insert or ignore into mapSolarSystemJumps values (?, ?, ?, ?, ?, ?)",
+                         (bysystem[f][0], bysystem[f][1], f, t, bysystem[t][1], bysystem[t][0]))
+
+    conn.commit()
+    conn.close()
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="build a synthetic static data dump")
+    parser.add_argument('path')
+    parser.add_argument('--systems', type=int, default=5000)
+    parser.add_argument('--types', type=int, default=20000)
+    parser.add_argument('--regions', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, systems=args.systems, types=args.types, regions=args.regions, seed=args.seed)
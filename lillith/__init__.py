@@ -1,5 +1,45 @@
-from .config import *
-from .local import *
-from .map import *
-from .items import *
-from .market import *
+import importlib
+
+# the public names of each submodule. Submodules are imported when one of
+# their names is first used, so importing lillith stays cheap for scripts
+# that only touch part of it.
+_exports = {
+    'config': ['initialize', 'Session', 'get_session'],
+    'indexes': ['ensure_indexes'],
+    'local': ['Equal', 'Like', 'Greater', 'GreaterEqual', 'Less', 'LessEqual', 'In', 'QuerySet', 'Count', 'Sum', 'Avg', 'Min', 'Max'],
+    'map': ['Region', 'Constellation', 'SolarSystem'],
+    'items': ['ItemType'],
+    'market': ['ItemPrice'],
+    'backends': ['HTTPBackend', 'Recorder', 'StoreBackend'],
+    'frame': ['PriceFrame'],
+    'reprocess': ['Reprocessor'],
+    'hauling': ['HaulingScanner'],
+    'names': ['NameIndex'],
+    'instrument': ['Report', 'collect', 'subscribe', 'unsubscribe'],
+    'route': ['JumpGraph'],
+    'distances': ['JumpDistances'],
+    'spatial': ['SpatialIndex', 'LIGHT_YEAR'],
+}
+
+# submodules that import numpy, multiprocessing or the HTTP stack. Their
+# names are left out of from lillith import *, which the shell uses, and
+# are imported only when asked for by name.
+_heavy = ('backends', 'frame', 'reprocess', 'hauling', 'distances', 'spatial')
+
+__all__ = [name for module, names in _exports.items() if module not in _heavy for name in names]
+
+_modules = dict((name, module) for module, names in _exports.items() for name in names)
+
+def __getattr__(name):
+    if name in _exports:
+        return importlib.import_module('.' + name, __name__)
+    try:
+        module = _modules[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name)) from None
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_modules) | set(_exports))
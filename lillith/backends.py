@@ -0,0 +1,202 @@
+import codecs
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import urllib.parse
+
+from .transport import HTTPTransport
+
+__all__ = ['HTTPBackend', 'Recorder', 'StoreBackend']
+
+# market backends answer requests for market API URLs with an iterable of
+# the rows in the response's emd.result, each a dict like
+#
+#     {'typeID': '34', 'regionID': '10000002', 'buysell': 's',
+#      'price': '5.01', 'updated': '2014-01-01 00:00:00'}
+#
+# and must be safe to call from several threads at once.
+
+_RESULT = re.compile(r'"result"\s*:\s*\[')
+_SEPARATOR = re.compile(r'[\s,]*')
+
+def _iter_result(chunks):
+    """yields the rows of an emd.result list from chunks of a JSON
+    document, decoding each as soon as it is complete"""
+    text = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = None
+    chunks = iter(chunks)
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        buf += text.decode(b'' if final else chunk, final=final)
+        if pos is None:
+            m = _RESULT.search(buf)
+            if m is None:
+                if final:
+                    raise RuntimeError(buf)
+                continue
+            pos = m.end()
+        while True:
+            pos = _SEPARATOR.match(buf, pos).end()
+            if buf.startswith(']', pos):
+                # read to the end, so the transport can reuse the
+                # connection and record the request
+                for _ in chunks:
+                    pass
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # the rest has not arrived yet
+                break
+            yield obj['row']
+        buf = buf[pos:]
+        pos = 0
+    raise RuntimeError("market response ended early: {}".format(buf[:200]))
+
+def _params(url):
+    """returns the query parameters of url that select market data"""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    query.pop('char_name', None)
+    return dict((k, v[0]) for k, v in sorted(query.items()))
+
+class HTTPBackend:
+    """fetches market data from the live API, parsing rows as the
+    response streams in"""
+    def __init__(self, maxsize=8, timeout=30):
+        self.transport = HTTPTransport(maxsize=maxsize, timeout=timeout)
+
+    def rows(self, url):
+        return _iter_result(self.transport.stream(url))
+
+    def close(self):
+        self.transport.close()
+
+class Recorder:
+    """passes requests through to backend, writing each complete
+    response to a file in directory. The files are JSON lines: the
+    request parameters, then one row per line."""
+    def __init__(self, backend, directory):
+        self.backend = backend
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        key = json.dumps(_params(url), sort_keys=True)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.jsonl')
+
+    def rows(self, url):
+        path = self.path(url)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        f = open(tmp, 'w')
+        try:
+            f.write(json.dumps(_params(url)) + '\n')
+            for row in self.backend.rows(url):
+                f.write(json.dumps(row) + '\n')
+                yield row
+        except BaseException:
+            f.close()
+            os.remove(tmp)
+            raise
+        f.close()
+        os.replace(tmp, path)
+
+class StoreBackend:
+    """answers requests from market data kept in a local SQLite file,
+    indexed by type and location. Fill it with import_rows,
+    import_recordings or import_csv."""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            # a location of 0 means none was given
+            conn.execute("create table if not exists prices (typeID integer not null, regionID integer not null, solarsystemID integer not null, buysell text not null, price real not null, updated text, primary key (typeID, regionID, solarsystemID, buysell))")
+            conn.execute("create index if not exists prices_region on prices (regionID, typeID)")
+            conn.execute("create index if not exists prices_solarsystem on prices (solarsystemID, typeID)")
+
+    def _conn(self):
+        try:
+            return self._local.conn
+        except AttributeError:
+            pass
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("pragma synchronous = normal")
+        self._local.conn = conn
+        return conn
+
+    def rows(self, url):
+        params = _params(url)
+        conds = []
+        args = []
+        for param, column in [('type_ids', 'typeID'), ('region_ids', 'regionID'), ('solarsystem_ids', 'solarsystemID')]:
+            if param in params:
+                ids = [int(i) for i in params[param].split(',')]
+                conds.append("{} in ({})".format(column, ', '.join('?' * len(ids))))
+                args += ids
+        if params.get('buysell', 'a') != 'a':
+            conds.append("buysell = ?")
+            args.append(params['buysell'])
+        if not conds:
+            raise ValueError("no market data selected by {}".format(url))
+
+        # answer with the location the request asked about, as the API does
+        if 'region_ids' in params:
+            fields = ['regionID']
+        elif 'solarsystem_ids' in params:
+            fields = ['solarsystemID']
+        else:
+            fields = ['regionID', 'solarsystemID']
+
+        query = "select typeID, regionID, solarsystemID, buysell, price, updated from prices where " + " and ".join(conds)
+        results = []
+        for typeid, regionid, systemid, buysell, price, updated in self._conn().execute(query, args):
+            row = {'typeID': typeid, 'buysell': buysell, 'price': price, 'updated': updated}
+            for field, value in [('regionID', regionid), ('solarsystemID', systemid)]:
+                if field in fields and value:
+                    row[field] = value
+            results.append(row)
+        return results
+
+    def import_rows(self, rows):
+        """adds rows like those the API returns, replacing any for the
+        same type, location and side; returns how many were added"""
+        def values():
+            for row in rows:
+                buysell = row['buysell'].lower()[:1]
+                if buysell not in ('b', 's'):
+                    raise ValueError("invalid value for buysell: {}".format(row['buysell']))
+                yield (int(row['typeID']), int(row.get('regionID') or 0), int(row.get('solarsystemID') or 0), buysell, float(row['price']), row.get('updated'))
+
+        conn = self._conn()
+        with conn:
+            before = conn.total_changes
+            conn.executemany("insert or replace into prices values (?, ?, ?, ?, ?, ?)", values())
+            return conn.total_changes - before
+
+    def import_recordings(self, directory):
+        """adds the responses a Recorder wrote to directory"""
+        count = 0
+        for path in sorted(glob.glob(os.path.join(directory, '*.jsonl'))):
+            with open(path) as f:
+                next(f, None)
+                count += self.import_rows(json.loads(line) for line in f)
+        return count
+
+    def import_csv(self, path):
+        """adds rows from a CSV file with a header naming the row fields,
+        typeID, regionID, solarsystemID, buysell, price and updated"""
+        with open(path, newline='') as f:
+            return self.import_rows(csv.DictReader(f))
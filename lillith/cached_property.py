@@ -1,18 +1,29 @@
+from .config import _run
+
 import functools
 
 # http://code.activestate.com/recipes/576563-cached-property/
 
 def cached_property(f):
-    """returns a cached property that is calculated by function f"""
+    """returns a cached property that is calculated by function f, in
+    the session of the object it belongs to, if it has one"""
     @functools.wraps(f)
     def get(self):
         try:
-            return self._property_cache[f]
+            return self._property_cache[f.__name__]
         except AttributeError:
             self._property_cache = {}
         except KeyError:
             pass
-        x = self._property_cache[f] = f(self)
+        x = self._property_cache[f.__name__] = _run(getattr(self, '_cfg', None), f, self)
         return x
         
     return property(get)
+
+def prime_cached_property(obj, name, value):
+    """stores value as the result of obj's cached property name"""
+    try:
+        cache = obj._property_cache
+    except AttributeError:
+        cache = obj._property_cache = {}
+    cache[name] = value
@@ -1,32 +1,270 @@
 from .timed_dict import TimedDict
+from .indexes import ensure_indexes
 
+import contextlib
+import contextvars
 import weakref
 import sqlite3
+import sys
+import threading
+import os
+import urllib.parse
 
-__all__ = ['initialize']
+__all__ = ['initialize', 'Session', 'get_session']
 
+# fix encoding issues
+def _eve_decode(b):
+    return b.decode("windows-1252")
+
+class _PooledConnection:
+    # holds a thread's connection; when the thread exits, its local data
+    # and so this go away, and the connection is closed
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+        weakref.finalize(self, conn.close)
+
+class ConnectionPool:
+    """hands out one read-only connection to the static data dump per
+    thread, so lookups can run concurrently without a global lock.
+    Connections are closed when their thread exits."""
+    def __init__(self, dbpath, mmap_size=256 * 1024 * 1024, cache_size=64 * 1024 * 1024):
+        path = urllib.parse.quote(os.path.abspath(dbpath))
+        self.uri = "file:{}?mode=ro&immutable=1".format(path)
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = weakref.WeakSet()
+
+    def get(self):
+        try:
+            return self._local.pooled.conn
+        except AttributeError:
+            pass
+
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.text_factory = _eve_decode
+        conn.execute("pragma mmap_size = {:d}".format(self.mmap_size))
+        # negative sizes are in KiB rather than pages
+        conn.execute("pragma cache_size = {:d}".format(-(self.cache_size // 1024)))
+        conn.execute("pragma query_only = 1")
+
+        pooled = _PooledConnection(conn)
+        self._local.pooled = pooled
+        with self._lock:
+            self._conns.add(pooled)
+        return conn
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = list(self._conns), weakref.WeakSet()
+        for pooled in conns:
+            pooled.conn.close()
+        self._local = threading.local()
+
+# the default session, set by initialize, and the one in use in this
+# context, if another has been chosen with Session.use
 _lillith_config = None
+_current = contextvars.ContextVar('lillith_session', default=None)
+_install_lock = threading.Lock()
+
 def _getcf():
+    session = _current.get()
+    if session is None:
+        session = _lillith_config
+        if session is None:
+            raise RuntimeError("lillith was not initialized")
+    return session
+
+def get_session():
+    """returns the session in use here"""
+    return _getcf()
+
+def _run(session, f, *args, **kwargs):
+    # calls f with session in use, if there is one
+    if session is None:
+        return f(*args, **kwargs)
+    token = _current.set(session)
+    try:
+        return f(*args, **kwargs)
+    finally:
+        _current.reset(token)
+
+def _run_iter(session, iterable):
+    # yields from iterable with session in use whenever it runs, however
+    # the caller's session changes between items
+    it = iter(iterable)
+    while True:
+        token = None
+        if (_current.get() or _lillith_config) is not session:
+            token = _current.set(session)
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            if token is not None:
+                _current.reset(token)
+        yield item
+
+def _install(session, replacing=None):
+    # makes session the default, if replacing still is
     global _lillith_config
-    if _lillith_config is None:
-        raise RuntimeError("lillith was not initialized")
-    return _lillith_config
-
-def initialize(dbpath, charname, cachetime=60*5):
-    class Config:
-        def __init__(self, dbpath, charname):
-            self.dbpath = dbpath
-            self.charname = charname
-            self.dbconn = sqlite3.connect(dbpath)
-            self.db = self.dbconn.cursor()
-            
-            # fix encoding issues
-            def eve_decode(b):
-                return b.decode("windows-1252")
-            self.dbconn.text_factory = eve_decode
-            
-            self.localcache = weakref.WeakValueDictionary()
-            self.marketcache = TimedDict(time=cachetime)
+    with _install_lock:
+        if replacing is not None and _lillith_config is not replacing:
+            return False
+        _lillith_config = session
+        return True
+
+def _default_cachedir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'lillith')
+
+def _results_sizeof(results):
+    # the size of a cached list of market objects: the objects and the
+    # rows they hold, but not the session or static data they refer to
+    size = sys.getsizeof(results)
+    for obj in results:
+        size += sys.getsizeof(obj) + sys.getsizeof(obj.__dict__) + sys.getsizeof(obj._data)
+        for k, v in obj._data.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    return size
+
+class Session:
+    """a static data dump and character name, with the connections and
+    caches that go with them.
+
+    initialize makes a session the default; use() makes another the one
+    in use for a block of code, and for the fetches it starts. Objects
+    remember the session that loaded them, and load their related objects
+    from it.
+    """
+    def __init__(self, dbpath, charname, cachetime=60*5, cachedir=None, indexes=False, explain=False, concurrency=8, cachesize=None, cachebytes=None, cachepath=None, serve_stale=False, market=None):
+        # indexes may be True, to index the dump in place, or a path to
+        # build and use an indexed copy at
+        if indexes:
+            if indexes is True:
+                indexes = None
+            dbpath = ensure_indexes(dbpath, indexes)
+
+        self.dbpath = dbpath
+        self.charname = charname
+        self.cachedir = cachedir or _default_cachedir()
+        self.explain = explain
+        self.concurrency = concurrency
+        self.pool = ConnectionPool(dbpath)
+        # close the pool's connections once nothing uses this session,
+        # as after a reload
+        weakref.finalize(self, self.pool.close)
         
-    global _lillith_config
-    _lillith_config = Config(dbpath, charname)
+        self.localcache = weakref.WeakValueDictionary()
+        self.tablecolumns = {}
+        self.nameindexes = {}
+        # cachesize bounds the number of cached responses, cachebytes
+        # their total size
+        self.marketcache = TimedDict(time=cachetime, max_entries=cachesize, max_bytes=cachebytes, sizeof=_results_sizeof)
+        # the fetcher and market backend are made on first use, so
+        # static data alone never imports the HTTP machinery
+        self._fetcher = None
+        self._market = market
+        self._lock = threading.Lock()
+        self.diskcache = None
+        if cachepath is not None:
+            from .disk_cache import DiskCache
+            self.diskcache = DiskCache(cachepath, time=cachetime)
+        # serve stale disk cache entries while they are refreshed
+        self.serve_stale = serve_stale
+        self.jumpgraph = None
+        self.jumpdistances = None
+        self.spatialindex = None
+
+    def __repr__(self):
+        return "<Session: {}>".format(self.dbpath)
+
+    @property
+    def fetcher(self):
+        with self._lock:
+            if self._fetcher is None:
+                from .fetch import Fetcher
+                self._fetcher = Fetcher(self.concurrency)
+            return self._fetcher
+
+    @property
+    def market(self):
+        # where market data comes from; see lillith.backends
+        with self._lock:
+            if self._market is None:
+                from .backends import HTTPBackend
+                self._market = HTTPBackend(maxsize=self.concurrency)
+            return self._market
+
+    @property
+    def dbconn(self):
+        return self.pool.get()
+
+    @property
+    def db(self):
+        return self.dbconn.cursor()
+
+    @contextlib.contextmanager
+    def use(self):
+        """makes this the session in use inside the with block"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def reload(self, dbpath, indexes=False, install=True):
+        """loads the static data dump at dbpath, which must be a new file,
+        into a new session in a background thread, and returns a future
+        for it. The new session shares this one's market backend, fetcher
+        and disk cache, and has built whatever jump graphs, distances and
+        indexes this one had before it is ready.
+
+        If install is true and this session is still the default when
+        the new one is ready, the new one replaces it. Anything still
+        using this session carries on with it undisturbed."""
+        import concurrent.futures
+        future = concurrent.futures.Future()
+
+        def load():
+            try:
+                session = Session(dbpath, self.charname, cachetime=self.marketcache.time, cachedir=self.cachedir, indexes=indexes, explain=self.explain, concurrency=self.concurrency, cachesize=self.marketcache.max_entries, cachebytes=self.marketcache.max_bytes, serve_stale=self.serve_stale, market=self.market)
+                session._fetcher = self.fetcher
+                session.diskcache = self.diskcache
+                _run(session, session._warm, self)
+                if install:
+                    _install(session, replacing=self)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(session)
+        threading.Thread(target=load, name='lillith-reload', daemon=True).start()
+        return future
+
+    def _warm(self, like):
+        # builds what the session like has built, so the first requests
+        # after a swap are not slower
+        from .route import get_jump_graph
+        from .names import get_name_index
+        self.dbconn.execute("select count(*) from sqlite_master").fetchone()
+        if like.jumpgraph is not None:
+            get_jump_graph()
+        if like.jumpdistances is not None:
+            from .distances import get_jump_distances
+            get_jump_distances()
+        if like.spatialindex is not None:
+            from .spatial import get_spatial_index
+            get_spatial_index()
+        for cls in list(like.nameindexes):
+            get_name_index(cls)
+
+def initialize(dbpath, charname, cachetime=60*5, **kwargs):
+    """makes a new Session the default, and returns it; see Session for
+    the arguments"""
+    session = Session(dbpath, charname, cachetime=cachetime, **kwargs)
+    _install(session)
+    return session
@@ -0,0 +1,68 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ['DiskCache']
+
+class DiskCache:
+    """a market cache kept in a SQLite file, so it is shared between
+    processes and survives restarts. Entries are JSON-encoded and stored
+    under a JSON encoding of their key.
+
+    Entries older than time are stale; entries older than max_stale are
+    never returned and are removed when the cache is opened.
+    """
+    def __init__(self, path, time=60*5, max_stale=60*60*24):
+        self.path = path
+        self.time = time
+        self.max_stale = max_stale
+        self._local = threading.local()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute("create table if not exists cache (key text primary key, value text not null, stored real not null)")
+            conn.execute("delete from cache where stored < ?", (_now() - max_stale,))
+
+    def _conn(self):
+        try:
+            return self._local.conn
+        except AttributeError:
+            pass
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("pragma synchronous = normal")
+        self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, separators=(',', ':'))
+
+    def get(self, key):
+        """returns (value, fresh) for key, or raises KeyError"""
+        row = self._conn().execute("select value, stored from cache where key = ?", (self._key(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value, stored = row
+        age = _now() - stored
+        if age > self.max_stale:
+            raise KeyError(key)
+        return json.loads(value), age <= self.time
+
+    def set(self, key, value):
+        conn = self._conn()
+        with conn:
+            conn.execute("insert or replace into cache (key, value, stored) values (?, ?, ?)", (self._key(key), json.dumps(value), _now()))
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("delete from cache")
+
+# wall-clock time, since entries are shared between processes
+_now = time.time
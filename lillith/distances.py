@@ -0,0 +1,174 @@
+from .config import _getcf
+from .route import get_jump_graph
+
+import array
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['JumpDistances']
+
+_MAGIC = b'LLJD0001'
+_HEADER = struct.Struct('<8sQ')
+
+UNREACHABLE = 255
+
+# the most entries in a JumpDistances ID lookup table
+_MAX_LOOKUP = 1 << 22
+
+# set in each worker by _init_worker
+_worker_graph = None
+
+def _init_worker(offsets, targets):
+    global _worker_graph
+    _worker_graph = (array.array('l', offsets), array.array('l', targets))
+
+def _bfs_rows(sources):
+    offsets, targets = _worker_graph
+    n = len(offsets) - 1
+    rows = bytearray()
+    for source in sources:
+        row = bytearray([UNREACHABLE]) * n
+        row[source] = 0
+        frontier = [source]
+        depth = 0
+        while frontier and depth < UNREACHABLE - 1:
+            depth += 1
+            nextfrontier = []
+            for a in frontier:
+                for b in targets[offsets[a]:offsets[a + 1]]:
+                    if row[b] == UNREACHABLE:
+                        row[b] = depth
+                        nextfrontier.append(b)
+            frontier = nextfrontier
+        rows += row
+    return bytes(rows)
+
+def _sde_key(dbpath):
+    # names the dump by its file's identity and modification time;
+    # hashing its contents took seconds in every new process
+    st = os.stat(dbpath)
+    return '{:x}-{:x}-{:x}-{:x}'.format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class JumpDistances:
+    """an all-pairs jump count matrix, memory-mapped from the cache
+
+    Distances are stored as one byte per pair; UNREACHABLE marks pairs
+    with no stargate route between them.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise RuntimeError("not a jump distance file: {}".format(path))
+
+        start = _HEADER.size
+        self.ids = array.array('q')
+        self.ids.frombytes(self._mmap[start:start + 8 * n])
+        self._index = dict((id, i) for i, id in enumerate(self.ids))
+
+        start += 8 * n
+        self.matrix = memoryview(self._mmap)[start:start + n * n]
+
+        # solar system ID - _base -> row, or -1, so distances() can look
+        # up many IDs at once; left out if the IDs are too spread out
+        self._lookup = None
+        if numpy is not None and n:
+            ids = numpy.frombuffer(self.ids, dtype=numpy.int64)
+            self._base = int(ids.min())
+            span = int(ids.max()) - self._base + 1
+            if span <= _MAX_LOOKUP:
+                self._lookup = numpy.full(span, -1, dtype=numpy.int32)
+                self._lookup[ids - self._base] = numpy.arange(n, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, id):
+        try:
+            return self._index[id]
+        except KeyError:
+            raise ValueError("unknown solar system: {}".format(id)) from None
+
+    def row(self, id):
+        """returns the distances from id to every system, in order of
+        self.ids, as a zero-copy memoryview"""
+        n = len(self.ids)
+        i = self.index(id)
+        return self.matrix[i * n:(i + 1) * n]
+
+    def distance(self, from_id, to_id):
+        """returns the number of jumps between two systems, or None"""
+        d = self.matrix[self.index(from_id) * len(self.ids) + self.index(to_id)]
+        if d == UNREACHABLE:
+            return None
+        return d
+
+    def distances(self, from_id, to_ids):
+        """returns the number of jumps from from_id to each of to_ids, or
+        None for those with no route"""
+        row = self.row(from_id)
+        if self._lookup is None:
+            index = self.index
+            return [None if d == UNREACHABLE else d for d in (row[index(id)] for id in to_ids)]
+
+        offsets = numpy.asarray(to_ids, dtype=numpy.int64) - self._base
+        known = (offsets >= 0) & (offsets < len(self._lookup))
+        rows = numpy.where(known, self._lookup.take(offsets, mode='clip'), -1)
+        if (rows < 0).any():
+            raise ValueError("unknown solar system: {}".format(int(offsets[rows < 0][0]) + self._base))
+        d = numpy.frombuffer(row, dtype=numpy.uint8).take(rows)
+        result = d.astype(object)
+        result[d == UNREACHABLE] = None
+        return result.tolist()
+
+    @classmethod
+    def build(cls, graph, path, processes=None):
+        """computes the matrix for graph in parallel and writes it to path"""
+        n = len(graph)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        chunksize = max(1, min(256, n // (processes * 4) or 1))
+        chunks = [range(i, min(i + chunksize, n)) for i in range(0, n, chunksize)]
+
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, n))
+                f.write(graph.ids.tobytes())
+                initargs = (graph.offsets.tobytes(), graph.targets.tobytes())
+                if processes > 1 and len(chunks) > 1:
+                    with multiprocessing.Pool(processes, _init_worker, initargs) as pool:
+                        for rows in pool.imap(_bfs_rows, chunks):
+                            f.write(rows)
+                else:
+                    _init_worker(*initargs)
+                    for chunk in chunks:
+                        f.write(_bfs_rows(chunk))
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+        return cls(path)
+
+def get_jump_distances(processes=None):
+    """returns the jump distance matrix for the loaded SDE, loading it
+    from the cache directory or building it there if needed"""
+    cfg = _getcf()
+    if cfg.jumpdistances is None:
+        path = os.path.join(cfg.cachedir, 'jumps-{}.bin'.format(_sde_key(cfg.dbpath)))
+        if os.path.exists(path):
+            cfg.jumpdistances = JumpDistances(path)
+        else:
+            cfg.jumpdistances = JumpDistances.build(get_jump_graph(), path, processes=processes)
+    return cfg.jumpdistances
@@ -0,0 +1,66 @@
+import concurrent.futures
+import contextvars
+import threading
+
+__all__ = ['Fetcher']
+
+def completed(result):
+    """returns a future that is already resolved to result"""
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+def gather(futures, combine=list):
+    """returns a future for combine(results of futures), which fails
+    if any of them does"""
+    futures = list(futures)
+    result = concurrent.futures.Future()
+    if not futures:
+        result.set_result(combine([]))
+        return result
+
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            result.set_result(combine([f.result() for f in futures]))
+        except BaseException as e:
+            result.set_exception(e)
+    for f in futures:
+        f.add_done_callback(done)
+    return result
+
+class Fetcher:
+    """runs network requests on a bounded thread pool, merging requests
+    for the same key that are already in flight into one"""
+    def __init__(self, concurrency=8):
+        self.concurrency = concurrency
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='lillith-fetch')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn):
+        """returns a future for fn(), or the future of the request for key
+        that is already running"""
+        with self._lock:
+            try:
+                return self._inflight[key]
+            except KeyError:
+                pass
+            # run in the caller's context, so instrumentation follows
+            future = self.executor.submit(contextvars.copy_context().run, fn)
+            self._inflight[key] = future
+
+        def done(f):
+            with self._lock:
+                if self._inflight.get(key) is f:
+                    del self._inflight[key]
+        future.add_done_callback(done)
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,116 @@
+from .local import In
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['PriceFrame']
+
+class PriceFrame:
+    """a columnar snapshot of market prices, one NumPy array per field.
+
+    buy is True for buy orders and False for sell orders. region_id and
+    system_id are 0 where the data does not say.
+    """
+    columns = ['type_id', 'region_id', 'system_id', 'buy', 'price']
+
+    def __init__(self, type_id, region_id, system_id, buy, price):
+        if numpy is None:
+            raise RuntimeError("numpy is required for price frames")
+        self.type_id = numpy.asarray(type_id, dtype=numpy.int64)
+        self.region_id = numpy.asarray(region_id, dtype=numpy.int64)
+        self.system_id = numpy.asarray(system_id, dtype=numpy.int64)
+        self.buy = numpy.asarray(buy, dtype=bool)
+        self.price = numpy.asarray(price, dtype=numpy.float64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """builds a frame from raw market API rows"""
+        rows = list(rows)
+        frame = cls(
+            [int(r['typeID']) for r in rows],
+            [int(r.get('regionID', 0)) for r in rows],
+            [int(r.get('solarsystemID', 0)) for r in rows],
+            [r['buysell'] == 'b' for r in rows],
+            [float(r['price']) for r in rows],
+        )
+        frame._fill_regions()
+        return frame
+
+    def _fill_regions(self):
+        # rows for solar systems do not carry their region; look them up
+        # in a single query
+        missing = (self.region_id == 0) & (self.system_id != 0)
+        if not missing.any():
+            return
+        ids = numpy.unique(self.system_id[missing]).tolist()
+        regions = dict((v['id'], v['region']) for v in SolarSystem.filter(id=In(ids)).values('id', 'region'))
+        self.region_id[missing] = [regions.get(int(s), 0) for s in self.system_id[missing]]
+
+    def __len__(self):
+        return len(self.price)
+
+    def __repr__(self):
+        return "<PriceFrame: {} prices>".format(len(self))
+
+    def select(self, mask):
+        """returns a frame of the rows where mask is true"""
+        return PriceFrame(*(getattr(self, c)[mask] for c in self.columns))
+
+    def where(self, type=None, region=None, solar_system=None, buysell=None):
+        mask = numpy.ones(len(self), dtype=bool)
+        for ids, col in [(type, self.type_id), (region, self.region_id), (solar_system, self.system_id)]:
+            if ids is None:
+                continue
+            if not isinstance(ids, list):
+                ids = [ids]
+            mask &= numpy.isin(col, [getattr(i, 'id', i) for i in ids])
+        if buysell is not None:
+            mask &= self.buy if buysell == 'buy' else ~self.buy
+        return self.select(mask)
+
+    def _group(self, by):
+        keys = numpy.stack([getattr(self, c) for c in by], axis=1)
+        unique, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        result = dict((c, unique[:, i]) for i, c in enumerate(by))
+        return result, inverse.reshape(-1), len(unique)
+
+    def best(self, by=('type_id', 'region_id')):
+        """returns a dict of arrays holding, for each group in by, the
+        highest buy price, the lowest sell price and the spread between
+        them. Groups without buy or sell orders hold nan."""
+        result, inverse, n = self._group(by)
+        best_buy = numpy.full(n, -numpy.inf)
+        numpy.maximum.at(best_buy, inverse[self.buy], self.price[self.buy])
+        best_sell = numpy.full(n, numpy.inf)
+        numpy.minimum.at(best_sell, inverse[~self.buy], self.price[~self.buy])
+        best_buy[numpy.isneginf(best_buy)] = numpy.nan
+        best_sell[numpy.isposinf(best_sell)] = numpy.nan
+        result['best_buy'] = best_buy
+        result['best_sell'] = best_sell
+        result['spread'] = best_sell - best_buy
+        return result
+
+    def percentile(self, q, by=('type_id', 'region_id'), buysell=None):
+        """returns a dict of arrays holding the q'th percentile price of
+        each group in by, interpolated linearly"""
+        frame = self if buysell is None else self.where(buysell=buysell)
+        result, inverse, n = frame._group(by)
+        order = numpy.lexsort((frame.price, inverse))
+        prices = frame.price[order]
+        counts = numpy.bincount(inverse, minlength=n)
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        pos = starts + (counts - 1) * (q / 100.0)
+        lo = numpy.floor(pos).astype(numpy.int64)
+        hi = numpy.ceil(pos).astype(numpy.int64)
+        result['percentile'] = prices[lo] + (prices[hi] - prices[lo]) * (pos - lo)
+        return result
+
+    def types(self):
+        """returns a dict mapping each type ID in the frame to its ItemType"""
+        return ItemType.in_bulk(numpy.unique(self.type_id).tolist())
+
+# late imports
+from .items import ItemType
+from .map import SolarSystem
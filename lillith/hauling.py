@@ -0,0 +1,140 @@
+from .local import QueryBuilder
+
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['HaulingScanner']
+
+Opportunity = collections.namedtuple('Opportunity', ['type', 'source', 'destination', 'source_price', 'destination_price', 'profit', 'profit_per_m3', 'units', 'trip_profit'])
+
+class HaulingScanner:
+    """finds the most profitable items to buy from sell orders in one
+    place and sell to buy orders in another, over a whole universe of
+    types at once.
+
+    type_ids and volume are parallel arrays over that universe, sorted
+    by type ID; types without a volume are left out.
+    """
+    def __init__(self, types=None):
+        if numpy is None:
+            raise RuntimeError("numpy is required for hauling scans")
+
+        data = list(QueryBuilder(ItemType).select('typeID', 'volume'))
+        type_ids = numpy.array([d['typeID'] for d in data], dtype=numpy.int64)
+        volume = numpy.array([d['volume'] or 0 for d in data], dtype=numpy.float64)
+        keep = volume > 0
+        if types is not None:
+            keep &= numpy.isin(type_ids, [getattr(t, 'id', t) for t in types])
+        order = numpy.argsort(type_ids[keep], kind='stable')
+        self.type_ids = type_ids[keep][order]
+        self.volume = volume[keep][order]
+
+    @staticmethod
+    def _locations(places):
+        # places may mix regions and solar systems; anything else is
+        # resolved as a region
+        places = [p if isinstance(p, (Region, SolarSystem)) else Region._resolve([p])[0] for p in places]
+        if not places:
+            raise ValueError("no places given")
+        return dict((p.id, p) for p in places)
+
+    def _best(self, frame, locations, buy):
+        # the best price of each type at each location, as a types x
+        # locations matrix holding nan where there are no orders
+        ids = numpy.array(sorted(locations), dtype=numpy.int64)
+        location = numpy.where(frame.system_id != 0, frame.system_id, frame.region_id)
+        mask = (frame.buy == buy) & numpy.isin(location, ids) & numpy.isin(frame.type_id, self.type_ids)
+        rows = numpy.searchsorted(self.type_ids, frame.type_id[mask])
+        cols = numpy.searchsorted(ids, location[mask])
+        if buy:
+            best = numpy.full((len(self.type_ids), len(ids)), -numpy.inf)
+            numpy.maximum.at(best, (rows, cols), frame.price[mask])
+        else:
+            best = numpy.full((len(self.type_ids), len(ids)), numpy.inf)
+            numpy.minimum.at(best, (rows, cols), frame.price[mask])
+        best[numpy.isinf(best)] = numpy.nan
+        return ids, best
+
+    def prices(self, sources, destinations):
+        """fetches the sell orders at sources and the buy orders at
+        destinations for every type, concurrently, as a PriceFrame"""
+        types = ItemType._resolve(self.type_ids.tolist())
+        queries = []
+        for places, buysell in [(sources, 'sell'), (destinations, 'buy')]:
+            regions = [p for p in places if isinstance(p, Region)]
+            systems = [p for p in places if isinstance(p, SolarSystem)]
+            if regions:
+                queries.append({'type': types, 'region': regions, 'buysell': buysell})
+            if systems:
+                queries.append({'type': types, 'solar_system': systems, 'buysell': buysell})
+        results = ItemPrice.filter_many(queries)
+        return PriceFrame.from_rows(p._data for prices in results for p in prices)
+
+    def scan(self, sources, destinations, n=20, capacity=None, budget=None, tax=0.0, key=None, frame=None):
+        """returns up to n Opportunity tuples for buying at the best sell
+        price in one of sources and selling at the best buy price in one
+        of destinations, best first.
+
+        Sales lose tax, a fraction of the price. If capacity (in m^3) is
+        given, units is how many fit in it, limited to what budget can
+        buy if that is given, and trip_profit is the profit on them.
+        key is 'unit', 'm3' or 'trip', and is 'trip' by default if
+        capacity is given and 'm3' otherwise. Pass frame to reuse prices
+        already fetched with prices()."""
+        if key is None:
+            key = 'trip' if capacity is not None else 'm3'
+        if key not in ('unit', 'm3', 'trip'):
+            raise ValueError("invalid key: {}".format(key))
+        if key == 'trip' and capacity is None:
+            raise ValueError("ranking by trip requires a capacity")
+
+        sources = self._locations(sources)
+        destinations = self._locations(destinations)
+        if frame is None:
+            frame = self.prices(list(sources.values()), list(destinations.values()))
+        src_ids, sell = self._best(frame, sources, False)
+        dst_ids, buy = self._best(frame, destinations, True)
+
+        # types x sources x destinations
+        profit = buy[:, None, :] * (1 - tax) - sell[:, :, None]
+        per_m3 = profit / self.volume[:, None, None]
+        valid = numpy.isfinite(profit) & (profit > 0) & (src_ids[:, None] != dst_ids[None, :])
+        units = trip = None
+        if capacity is not None:
+            units = numpy.floor(capacity / self.volume)[:, None, None] * numpy.ones_like(profit)
+            if budget is not None:
+                units = numpy.minimum(units, numpy.floor(budget / sell)[:, :, None])
+            units[~valid] = 0
+            trip = units * profit
+            valid &= units > 0
+        score = {'unit': profit, 'm3': per_m3, 'trip': trip}[key]
+
+        candidates = numpy.nonzero(valid.ravel())[0]
+        best = candidates[numpy.argsort(-score.ravel()[candidates], kind='stable')[:n]]
+        t, s, d = numpy.unravel_index(best, profit.shape)
+        types = ItemType.in_bulk(self.type_ids[t].tolist())
+
+        results = []
+        for ti, si, di in zip(t.tolist(), s.tolist(), d.tolist()):
+            results.append(Opportunity(
+                types[int(self.type_ids[ti])],
+                sources[int(src_ids[si])],
+                destinations[int(dst_ids[di])],
+                float(sell[ti, si]),
+                float(buy[ti, di]),
+                float(profit[ti, si, di]),
+                float(per_m3[ti, si, di]),
+                None if units is None else int(units[ti, si, di]),
+                None if trip is None else float(trip[ti, si, di]),
+            ))
+        return results
+
+# late imports
+from .items import ItemType
+from .map import Region, SolarSystem
+from .market import ItemPrice
+from .frame import PriceFrame
@@ -2,6 +2,7 @@ from .cached_property import cached_property
 from .html import HTMLBuilder
 
 class IconObject:
+    __slots__ = ()
     _icon_type = None
     _icon_size = 64
 
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import sys
+
+__all__ = ['ensure_indexes']
+
+# (table, column) pairs lillith filters or joins on
+INDEXES = [
+    ('invTypes', 'typeName'),
+    ('invTypes', 'groupID'),
+    ('invGroups', 'categoryID'),
+    ('invTypeMaterials', 'typeID'),
+    ('invTypeMaterials', 'materialTypeID'),
+    ('mapRegions', 'regionName'),
+    ('mapConstellations', 'constellationName'),
+    ('mapConstellations', 'regionID'),
+    ('mapSolarSystems', 'solarSystemName'),
+    ('mapSolarSystems', 'regionID'),
+    ('mapSolarSystems', 'constellationID'),
+    ('mapSolarSystemJumps', 'fromSolarSystemID'),
+]
+
+# Like is case-insensitive, so it can only use indexes with this collation
+NOCASE_INDEXES = [
+    ('invTypes', 'typeName'),
+    ('mapRegions', 'regionName'),
+    ('mapConstellations', 'constellationName'),
+    ('mapSolarSystems', 'solarSystemName'),
+]
+
+def _columns(conn, table):
+    return set(row[1] for row in conn.execute("pragma table_info({})".format(table)))
+
+def ensure_indexes(dbpath, target=None):
+    """creates the indexes lillith needs on the static data dump at
+    dbpath. If target is given, the dump is first copied there (unless
+    target already exists) and only the copy is changed. Returns the
+    path of the indexed database."""
+    if target is not None:
+        if not os.path.exists(target):
+            src = sqlite3.connect(dbpath)
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+        dbpath = target
+
+    conn = sqlite3.connect(dbpath)
+    try:
+        columns = {}
+        def exists(table, column):
+            if table not in columns:
+                columns[table] = _columns(conn, table)
+            return column in columns[table]
+
+        for table, column in INDEXES:
+            if exists(table, column):
+                conn.execute("create index if not exists lillith_{0}_{1} on {0} ({1})".format(table, column))
+        for table, column in NOCASE_INDEXES:
+            if exists(table, column):
+                conn.execute("create index if not exists lillith_{0}_{1}_nocase on {0} ({1} collate nocase)".format(table, column))
+        conn.execute("analyze")
+        conn.commit()
+    finally:
+        conn.close()
+    return dbpath
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        print("usage: {} <dbpath> [target]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    print(ensure_indexes(*sys.argv[1:]))
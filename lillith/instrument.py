@@ -0,0 +1,91 @@
+import contextlib
+import contextvars
+import logging
+import time
+
+__all__ = ['Report', 'collect', 'subscribe', 'unsubscribe']
+
+logger = logging.getLogger(__name__)
+
+# functions called as fn(event, data) for every event, everywhere
+_subscribers = []
+# the reports collecting events in the current context
+_reports = contextvars.ContextVar('lillith_reports', default=())
+
+def subscribe(fn):
+    """calls fn(event, data) for every event emitted from now on"""
+    _subscribers.append(fn)
+
+def unsubscribe(fn):
+    _subscribers.remove(fn)
+
+def active():
+    """returns True if anything is listening for events"""
+    return bool(_subscribers) or bool(_reports.get())
+
+def emit(event, **data):
+    """sends an event to every subscriber and every collecting report.
+    The events lillith emits are:
+
+     * query: sql, params, rows, seconds
+     * localcache: type, id, hit
+     * marketcache: key, hit, source ('memory' or 'disk', when hit)
+     * fetch: url, status, bytes, wire_bytes, seconds
+    """
+    for fn in list(_subscribers):
+        fn(event, data)
+    for report in _reports.get():
+        report.record(event, data)
+
+class Report:
+    """the events emitted while a collect() block was running"""
+    def __init__(self):
+        self.events = []
+        self.started = time.monotonic()
+        self.seconds = None
+
+    def record(self, event, data):
+        self.events.append((event, data))
+
+    def _of(self, event):
+        return [data for e, data in self.events if e == event]
+
+    def summary(self):
+        queries = self._of('query')
+        local = self._of('localcache')
+        market = self._of('marketcache')
+        fetches = self._of('fetch')
+        return {
+            'seconds': self.seconds if self.seconds is not None else time.monotonic() - self.started,
+            'queries': len(queries),
+            'query_rows': sum(d['rows'] for d in queries),
+            'query_seconds': sum(d['seconds'] for d in queries),
+            'localcache_hits': sum(1 for d in local if d['hit']),
+            'localcache_misses': sum(1 for d in local if not d['hit']),
+            'marketcache_hits': sum(1 for d in market if d['hit']),
+            'marketcache_misses': sum(1 for d in market if not d['hit']),
+            'fetches': len(fetches),
+            'fetch_bytes': sum(d['bytes'] for d in fetches),
+            'fetch_seconds': sum(d['seconds'] for d in fetches),
+        }
+
+    def log(self, logger=logger, level=logging.INFO, events=True):
+        """writes the report as JSON log lines: one per event, if events
+        is true, then the summary"""
+        import json
+        if events:
+            for event, data in self.events:
+                logger.log(level, "%s", json.dumps(dict(data, event=event), default=str))
+        logger.log(level, "%s", json.dumps(dict(self.summary(), event='summary')))
+
+@contextlib.contextmanager
+def collect():
+    """collects the events emitted in this context, including by market
+    requests it starts, into a Report"""
+    report = Report()
+    token = _reports.set(_reports.get() + (report,))
+    try:
+        yield report
+    finally:
+        _reports.reset(token)
+        report.seconds = time.monotonic() - report.started
@@ -1,13 +1,28 @@
-from .local import LocalObject, QueryBuilder
-from .cached_property import cached_property
+from .local import LocalObject, QueryBuilder, QuerySet
+from .cached_property import cached_property, prime_cached_property
 from .icons import IconObject
-from .config import _getcf
+from .config import _getcf, _run
 
 __all__ = ['ItemType']
 
 
 class ItemGroup(LocalObject):
+    __slots__ = ()
     _table = 'invGroups'
+    _lazy_columns = ('description',)
+    _fields = {
+        'id': 'groupID',
+        'category': 'categoryID',
+        'name': 'groupName',
+        'description': 'description',
+        'use_base_price': 'useBasePrice',
+        'allow_manufacture': 'allowManufacture',
+        'allow_recycler': 'allowRecycler',
+        'anchored': 'anchored',
+        'anchorable': 'anchorable',
+        'fittable_non_singleton': 'fittableNonSingleton',
+        'published': 'published',
+    }
 
     def __repr__(self):
         return "<Group: {}>".format(self.name)
@@ -20,6 +35,7 @@ class ItemGroup(LocalObject):
         qb.conditions(locals(),
                       name = "groupName",
                       id = "groupID",
+                      category_id = "categoryID",
                       description = "description",
                       use_base_price = "useBasePrice",
                       allow_manufacture = "allowManufacture",
@@ -30,8 +46,7 @@ class ItemGroup(LocalObject):
                       published = "published",
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['groupID'], data=data)
+        return QuerySet(cls, qb)
 
     @property
     def name(self):
@@ -74,7 +89,15 @@ class ItemGroup(LocalObject):
         return bool(self._data['published'])
 
 class ItemCategory(LocalObject):
+    __slots__ = ()
     _table = 'invCategories'
+    _lazy_columns = ('description',)
+    _fields = {
+        'id': 'categoryID',
+        'name': 'categoryName',
+        'description': 'description',
+        'published': 'published',
+    }
 
     def __repr__(self):
         return "<Category: {}>".format(self.name)
@@ -90,8 +113,7 @@ class ItemCategory(LocalObject):
                       published = "published",
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['categoryID'], data=data)
+        return QuerySet(cls, qb)
 
     @property
     def name(self):
@@ -107,7 +129,14 @@ class ItemCategory(LocalObject):
 
 
 class ItemTypeMaterial(LocalObject):
+    __slots__ = ()
     _table = 'invTypeMaterials'
+    _fields = {
+        'id': 'rowid',
+        'type': 'typeID',
+        'material_type': 'materialTypeID',
+        'quantity': 'quantity',
+    }
 
     @cached_property
     def type(self):
@@ -143,11 +172,25 @@ class ItemTypeMaterial(LocalObject):
                       material_type = 'materialTypeID',
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['rowid'], data=data)
+        return QuerySet(cls, qb)
 
 class ItemType(LocalObject, IconObject):
+    __slots__ = ()
     _table = 'invTypes'
+    _lazy_columns = ('description',)
+    _fields = {
+        'id': 'typeID',
+        'group': 'groupID',
+        'name': 'typeName',
+        'description': 'description',
+        'mass': 'mass',
+        'volume': 'volume',
+        'capacity': 'capacity',
+        'portion_size': 'portionSize',
+        'base_price': 'basePrice',
+        'published': 'published',
+        'chance_of_duplicating': 'chanceOfDuplicating',
+    }
     _icon_type = 'Type'
     
     # groupID
@@ -200,8 +243,21 @@ class ItemType(LocalObject, IconObject):
         mats = ItemTypeMaterial.filter(type=self)
         return dict((m.material_type, m.quantity) for m in mats)
 
+    @classmethod
+    def _prefetch_materials(cls, types):
+        mats = list(ItemTypeMaterial._filter_in('type', set(t.id for t in types)))
+        # keep the material types alive until they are stored on each type
+        mattypes = list(cls._filter_in('id', set(m._data['materialTypeID'] for m in mats)))
+        bytype = dict((t.id, {}) for t in types)
+        for m in mats:
+            bytype[m._data['typeID']][m.material_type] = m.quantity
+        for t in types:
+            prime_cached_property(t, 'materials', bytype[t.id])
+
     def get_prices(self, **kwargs):
-        return ItemPrice.filter(type=self, **kwargs)
+        # market data is imported on first use, to keep importing cheap
+        from .market import ItemPrice
+        return _run(self._cfg, ItemPrice.filter, type=self, **kwargs)
 
     def __repr__(self):
         return "<ItemType: {}>".format(self.name)
@@ -227,8 +283,8 @@ class ItemType(LocalObject, IconObject):
                       chance_of_duplicating = "chanceOfDuplicating",
         )
         
-        for data in qb.select():
-            yield cls.new_from_id(data['typeID'], data=data)
+        return QuerySet(cls, qb)
 
-# late imports
-from .market import ItemPrice
+ItemGroup._related = {'category': ItemCategory}
+ItemTypeMaterial._related = {'type': ItemType, 'material_type': ItemType}
+ItemType._related = {'group': ItemGroup}
@@ -1,12 +1,30 @@
-from .config import _getcf
+from .config import _getcf, _run, _run_iter
+from .cached_property import prime_cached_property
+from . import instrument
 
-__all__ = ['Equal', 'Like', 'Greater', 'GreaterEqual', 'Less', 'LessEqual']
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# query plan steps that explain mode does not warn about; older SQLite
+# versions write "SUBQUERY 1" where newer ones write "(subquery-1)"
+_HARMLESS_SCANS = ("SCAN CONSTANT ROW", "SCAN (subquery", "SCAN SUBQUERY")
+
+__all__ = ['Equal', 'Like', 'Greater', 'GreaterEqual', 'Less', 'LessEqual', 'In', 'QuerySet', 'Count', 'Sum', 'Avg', 'Min', 'Max']
 
 class LocalObject:
+    __slots__ = ('id', '_cfg', '_data', '_property_cache', '__weakref__')
     _table = None
+    # maps python-side field names to columns; 'id' must be present
+    _fields = {}
+    # maps field names that hold foreign keys to the class they refer to
+    _related = {}
+    # large columns that are only loaded when first used
+    _lazy_columns = ()
     
     def __new__(cls, **kwargs):
-        obj, = cls.filter(**kwargs)
+        obj, = cls.filter(**kwargs)[:2]
         return obj
     
     def __init__(self, **kwargs):
@@ -20,20 +38,28 @@ class LocalObject:
     def new_from_id(cls, id, data=None):
         cfg = _getcf()
         try:
-            return cfg.localcache[(cls, id)]
+            obj = cfg.localcache[(cls, id)]
         except KeyError:
             pass
+        else:
+            if instrument.active():
+                instrument.emit('localcache', type=cls.__name__, id=id, hit=True)
+            return obj
+        if instrument.active():
+            instrument.emit('localcache', type=cls.__name__, id=id, hit=False)
         
         obj = super().__new__(cls)
         obj.id = id
         obj._cfg = cfg
 
-        if data:
-            obj._data = data
-        else:
-            qb = QueryBuilder(obj)
+        if data is None:
+            qb = QueryBuilder(cls)
             qb.condition("rowid", id)
-            obj._data, = qb.select()
+            data, = qb.select(*cls._columns())
+        if not isinstance(data, Row):
+            data = Row.from_dict(cls, id, data)
+        data._cfg = cfg
+        obj._data = data
 
         obj.__init__()
         cfg.localcache[(cls, id)] = obj
@@ -43,6 +69,92 @@ class LocalObject:
     def all(cls):
         return cls.filter()
 
+    @classmethod
+    def search(cls, text, limit=10, scores=False):
+        """returns up to limit objects whose names best match text, by
+        prefix, substring or fuzzy match. If scores is true, returns
+        (object, score) pairs instead."""
+        results = get_name_index(cls).search(text, limit=limit)
+        objs = cls.in_bulk([id for id, _ in results])
+        if scores:
+            return [(objs[id], score) for id, score in results]
+        return [objs[id] for id, _ in results]
+
+    @classmethod
+    def _columns(cls):
+        """returns the columns loaded up front: all but the lazy ones"""
+        cfg = _getcf()
+        try:
+            return cfg.tablecolumns[cls._table]
+        except KeyError:
+            pass
+        c = cfg.dbconn.execute("pragma table_info({})".format(cls._table))
+        columns = [row[1] for row in c if row[1] not in cls._lazy_columns]
+        cfg.tablecolumns[cls._table] = columns
+        return columns
+
+    @classmethod
+    def _filter_in(cls, field, values):
+        """yields the objects whose field is any of values, a chunk of
+        values per query"""
+        column = cls._fields[field]
+        values = list(values)
+        for i in range(0, len(values), _IN_CHUNK):
+            chunk = values[i:i + _IN_CHUNK]
+            qb = QueryBuilder(cls)
+            qb.condition(column, In(chunk))
+            yield from QuerySet(cls, qb)
+
+    @classmethod
+    def in_bulk(cls, ids):
+        """returns a dict mapping each of ids to its object, fetching
+        those not already cached in as few queries as possible"""
+        cfg = _getcf()
+        result = {}
+        missing = []
+        for id in ids:
+            try:
+                result[id] = cfg.localcache[(cls, id)]
+            except KeyError:
+                missing.append(id)
+        for obj in cls._filter_in('id', set(missing)):
+            result[obj.id] = obj
+        return result
+
+    @classmethod
+    def _resolve(cls, values):
+        """converts a list of objects, IDs and names (or name
+        comparisons) into objects, looking up IDs and names in bulk"""
+        ids = [v for v in values if isinstance(v, int)]
+        names = [v for v in values if isinstance(v, str)]
+        byid = cls.in_bulk(ids)
+        byname = {}
+        for obj in cls._filter_in('name', set(names)):
+            if obj.name in byname:
+                raise ValueError("more than one {} named {}".format(cls.__name__, obj.name))
+            byname[obj.name] = obj
+
+        result = []
+        for v in values:
+            if isinstance(v, cls):
+                result.append(v)
+            elif isinstance(v, int):
+                try:
+                    result.append(byid[v])
+                except KeyError:
+                    raise ValueError("no {} with id {}".format(cls.__name__, v)) from None
+            elif isinstance(v, str):
+                try:
+                    result.append(byname[v])
+                except KeyError:
+                    raise ValueError("no {} named {}".format(cls.__name__, v)) from None
+            else:
+                result.append(cls(name=v))
+        return result
+
+# stays well below SQLite's default limit on bound variables
+_IN_CHUNK = 500
+
 class Comparison:
     def render(self, field):
         raise NotImplementedError("render")
@@ -72,11 +184,442 @@ class Less(SimpleComparison):
 class LessEqual(SimpleComparison):
     format = "{} <= ?"
 
+# column name -> index maps, shared by every row with the same columns
+_column_maps = {}
+
+def _column_map(columns):
+    columns = tuple(columns)
+    try:
+        return _column_maps[columns]
+    except KeyError:
+        return _column_maps.setdefault(columns, dict((c, i) for i, c in enumerate(columns)))
+
+class Row:
+    """a table row stored as a tuple of values. Columns that were not
+    selected, such as lazy ones, are loaded on first access."""
+    __slots__ = ('_cls', '_id', '_columns', '_values', '_cfg')
+
+    def __init__(self, cls, id, columns, values):
+        self._cls = cls
+        self._id = id
+        self._columns = columns
+        self._values = values
+        # the session to load the rest from, once the row has an owner
+        self._cfg = None
+
+    @classmethod
+    def from_dict(cls, owner, id, data):
+        items = [(k, v) for k, v in data.items() if k not in owner._lazy_columns]
+        return cls(owner, id, _column_map(k for k, _ in items), tuple(v for _, v in items))
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._columns[key]]
+        except KeyError:
+            pass
+
+        qb = QueryBuilder(self._cls)
+        qb.condition("rowid", self._id)
+        data, = _run(self._cfg, list, qb.select())
+        if key not in data:
+            raise KeyError(key)
+        # keep what we had, everything eager and the column asked for
+        keep = set(self._columns).union(self._cls._columns(), [key])
+        items = [(k, v) for k, v in data.items() if k in keep]
+        self._columns = _column_map(k for k, _ in items)
+        self._values = tuple(v for _, v in items)
+        return self._values[self._columns[key]]
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def keys(self):
+        return self._columns.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class QuerySet:
+    """a lazy, chainable query over a LocalObject table, run in the
+    session it was made in"""
+    def __init__(self, cls, qb, session=None):
+        self.cls = cls
+        self.qb = qb
+        self._session = session if session is not None else _getcf()
+        self._values = None
+        self._only = None
+        self._related = []
+        self._prefetch = []
+        self._annotations = {}
+        # once annotated, ordering and slicing apply to the groups
+        self._group_order = []
+        self._group_limit = None
+        self._group_offset = 0
+
+    def _clone(self):
+        qs = QuerySet(self.cls, self.qb.copy(), self._session)
+        qs._values = self._values
+        qs._only = self._only
+        qs._related = list(self._related)
+        qs._prefetch = list(self._prefetch)
+        qs._annotations = dict(self._annotations)
+        qs._group_order = list(self._group_order)
+        qs._group_limit = self._group_limit
+        qs._group_offset = self._group_offset
+        return qs
+
+    def _column(self, name):
+        try:
+            return self.cls._fields[name]
+        except KeyError:
+            raise ValueError("unknown field for {}: {}".format(self.cls.__name__, name)) from None
+
+    def __iter__(self):
+        return _run_iter(self._session, self._iter())
+
+    def _iter(self):
+        if self._prefetch:
+            objs = list(self._iter_objects())
+            for name in self._prefetch:
+                getattr(self.cls, '_prefetch_' + name)(objs)
+            yield from objs
+        else:
+            yield from self._iter_objects()
+
+    def _iter_objects(self):
+        if self._annotations:
+            yield from self._iter_annotated()
+            return
+
+        if self._values is not None:
+            columns = [self._column(name) for name in self._values]
+            for data in self.qb.select(*columns):
+                yield dict((name, data[col]) for name, col in zip(self._values, columns))
+            return
+
+        if self._related:
+            yield from self._iter_related()
+            return
+
+        if self._only is not None:
+            columns = [self._column('id')] + [self._column(name) for name in self._only]
+        else:
+            columns = self.cls._columns()
+        idfield = self._column('id')
+        for cmap, values in self.qb.rows(*columns):
+            id = values[cmap[idfield]]
+            yield self.cls.new_from_id(id, data=Row(self.cls, id, cmap, values))
+
+    def _aggregate_query(self, fields, aggregates):
+        return self.qb._execute(*self._aggregate_render(fields, aggregates))
+
+    def _aggregate_render(self, fields, aggregates):
+        # aggregates, a dict of name to aggregate, run over the filtered
+        # rows as a subquery; groups are then ordered and sliced
+        query, params = self.qb._render("rowid as rowid, *")
+        params = list(params)
+        columns = [self._column(name) for name in fields]
+        columns += ['{} as "{}"'.format(agg.render(None if agg.field is None else self._column(agg.field)), name) for name, agg in aggregates.items()]
+        query = "select {} from ({})".format(", ".join(columns), query)
+        if fields:
+            group = [self._column(name) for name in fields]
+            query += " group by " + ", ".join(group)
+            order = ['"{}"{}'.format(name, " desc" if desc else "") if name in aggregates else "{}{}".format(self._column(name), " desc" if desc else "") for name, desc in self._group_order]
+            query += " order by " + ", ".join(order + group)
+            if self._group_limit is not None or self._group_offset:
+                query += " limit ? offset ?"
+                params += [-1 if self._group_limit is None else self._group_limit, self._group_offset]
+        return query, tuple(params)
+
+    def _iter_annotated(self):
+        names = list(self._annotations)
+        c = self._aggregate_query(self._values, self._annotations)
+        for row in c:
+            yield dict(zip(self._values + names, row))
+
+    def _related_plan(self):
+        # a list of (alias, cls, parent index, field name), parents first;
+        # the base table is index 0
+        plan = [(self.cls._table, self.cls, None, None)]
+        for path in self._related:
+            parent = 0
+            for name in path.split('__'):
+                for i, (_, _, p, n) in enumerate(plan):
+                    if p == parent and n == name:
+                        parent = i
+                        break
+                else:
+                    pcls = plan[parent][1]
+                    plan.append(('t{}'.format(len(plan)), pcls._related[name], parent, name))
+                    parent = len(plan) - 1
+        return plan
+
+    def _iter_related(self):
+        plan = self._related_plan()
+        qb = self.qb.copy()
+        for alias, cls, parent, name in plan[1:]:
+            palias, pcls, _, _ = plan[parent]
+            qb.joins.append("left join {} as {} on {}.{} = {}.{}".format(cls._table, alias, alias, cls._fields['id'], palias, pcls._fields[name]))
+        fields = ", ".join("{0}.rowid as rowid, {0}.*".format(alias) for alias, _, _, _ in plan)
+
+        c = qb._execute(*qb._render(fields))
+        names = [i[0] for i in c.description]
+        bounds = [i for i, n in enumerate(names) if n == 'rowid'] + [len(names)]
+        for row in c:
+            objs = []
+            for (_, cls, parent, name), start, end in zip(plan, bounds, bounds[1:]):
+                if row[start] is None:
+                    obj = None
+                else:
+                    data = dict(zip(names[start:end], row[start:end]))
+                    obj = cls.new_from_id(data[cls._fields['id']], data=data)
+                if parent is not None and objs[parent] is not None:
+                    prime_cached_property(objs[parent], name, obj)
+                objs.append(obj)
+            yield objs[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError("QuerySet slices cannot have a step")
+            start = key.start or 0
+            if start < 0 or (key.stop is not None and key.stop < 0):
+                raise ValueError("QuerySet slices cannot be negative")
+            qs = self._clone()
+            if qs._annotations:
+                qs._group_limit, qs._group_offset = _narrow(qs._group_limit, qs._group_offset, start, key.stop)
+            else:
+                qs.qb.slice(start, key.stop)
+            return qs
+
+        if key < 0:
+            raise ValueError("QuerySet indices cannot be negative")
+        try:
+            obj, = self[key:key + 1]
+        except ValueError:
+            raise IndexError(key) from None
+        return obj
+
+    def all(self):
+        return self._clone()
+
+    def filter(self, **kwargs):
+        if self.qb.limit is not None or self.qb.offset or self._group_limit is not None or self._group_offset:
+            raise ValueError("cannot filter a sliced QuerySet")
+        other = _run(self._session, self.cls.filter, **kwargs)
+        qs = self._clone()
+        qs.qb.conds += other.qb.conds
+        qs.qb.condfields += other.qb.condfields
+        return qs
+
+    def order_by(self, *names):
+        """orders by the named fields, or '-name' for descending; after
+        annotate, the names may also be annotations, and order the groups"""
+        qs = self._clone()
+        qs.qb.order = []
+        qs._group_order = []
+        for name in names:
+            desc = name.startswith('-')
+            name = name.lstrip('-')
+            if name not in self._annotations:
+                qs.qb.order.append((self._column(name), desc))
+            qs._group_order.append((name, desc))
+        return qs
+
+    def values(self, *names):
+        """yields dicts of the named fields instead of objects"""
+        qs = self._clone()
+        qs._values = list(names) if names else list(self.cls._fields)
+        for name in qs._values:
+            self._column(name)
+        return qs
+
+    def only(self, *names):
+        """selects only the named fields; the rest are loaded on demand"""
+        if self._related:
+            raise ValueError("cannot combine select_related with only")
+        qs = self._clone()
+        qs._only = list(names)
+        for name in names:
+            self._column(name)
+        return qs
+
+    def select_related(self, *paths):
+        """follows the named foreign keys, such as 'group__category', in
+        the same query"""
+        if self._only is not None:
+            raise ValueError("cannot combine select_related with only")
+        qs = self._clone()
+        for path in paths:
+            cls = self.cls
+            for name in path.split('__'):
+                try:
+                    cls = cls._related[name]
+                except KeyError:
+                    raise ValueError("unknown relation for {}: {}".format(cls.__name__, name)) from None
+            qs._related.append(path)
+        return qs
+
+    def prefetch_related(self, *names):
+        """loads the named reverse relations, such as 'materials', for
+        every result in a few batched queries"""
+        qs = self._clone()
+        for name in names:
+            if not hasattr(self.cls, '_prefetch_' + name):
+                raise ValueError("cannot prefetch {} for {}".format(name, self.cls.__name__))
+            qs._prefetch.append(name)
+        return qs
+
+    def aggregate(self, **aggregates):
+        """returns a dict of the named aggregates, such as
+        avg_volume=Avg('volume'), over every result"""
+        names = list(aggregates)
+        c = _run(self._session, self._aggregate_query, [], aggregates)
+        return dict(zip(names, c.fetchone()))
+
+    def annotate(self, **aggregates):
+        """after values(), groups by the selected fields and adds the
+        named aggregates to each group's dict"""
+        if self._values is None:
+            raise ValueError("annotate must follow values")
+        for agg in aggregates.values():
+            if agg.field is not None:
+                self._column(agg.field)
+        qs = self._clone()
+        qs._annotations.update(aggregates)
+        return qs
+
+    def _groups(self, outer):
+        # runs outer, a query with a {} for the grouped query, and
+        # returns its single value
+        query, params = self._aggregate_render(self._values, self._annotations)
+        return self.qb._execute(outer.format(query), params).fetchone()[0]
+
+    def count(self):
+        """returns the number of results, or of groups after annotate"""
+        if self._annotations:
+            return _run(self._session, self._groups, "select count(*) from ({})")
+        return _run(self._session, self.qb.count)
+
+    def exists(self):
+        if self._annotations:
+            return bool(_run(self._session, self._groups, "select exists ({})"))
+        return _run(self._session, self.qb.exists)
+
+class In(Comparison):
+    def __init__(self, vals):
+        self.vals = list(vals)
+    def render(self, field):
+        return ("{} in ({})".format(field, ", ".join("?" * len(self.vals))), self.vals)
+
+class Aggregate:
+    function = None
+    def __init__(self, field=None):
+        self.field = field
+    def render(self, column):
+        return "{}({})".format(self.function, column)
+
+class Count(Aggregate):
+    function = "count"
+    def render(self, column):
+        if column is None:
+            column = "*"
+        return super().render(column)
+
+class Sum(Aggregate):
+    function = "sum"
+
+class Avg(Aggregate):
+    function = "avg"
+
+class Min(Aggregate):
+    function = "min"
+
+class Max(Aggregate):
+    function = "max"
+
+class _TimedCursor:
+    """wraps a cursor to emit a query event once its rows are read, or
+    it is abandoned. seconds is the time spent in SQLite, executing and
+    stepping through rows, not the time the caller spent between them."""
+    def __init__(self, cursor, query, params, seconds):
+        self._cursor = cursor
+        self.description = cursor.description
+        self._query = query
+        self._params = params
+        self._seconds = seconds
+        self._rows = 0
+        self._done = False
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            instrument.emit('query', sql=self._query, params=self._params, rows=self._rows, seconds=self._seconds)
+
+    def __iter__(self):
+        # the finally also runs when an abandoned iterator is closed or
+        # collected
+        try:
+            while True:
+                start = time.monotonic()
+                row = next(self._cursor, None)
+                self._seconds += time.monotonic() - start
+                if row is None:
+                    return
+                self._rows += 1
+                yield row
+        finally:
+            self._finish()
+
+    def fetchone(self):
+        start = time.monotonic()
+        row = self._cursor.fetchone()
+        self._seconds += time.monotonic() - start
+        if row is not None:
+            self._rows += 1
+        self._finish()
+        return row
+
+def _narrow(limit, offset, start, stop):
+    # the limit and offset of [start:stop] of results already limited
+    # and offset by limit and offset
+    if stop is not None:
+        length = max(0, stop - start)
+        if limit is not None:
+            length = min(length, max(0, limit - start))
+        limit = length
+    elif limit is not None:
+        limit = max(0, limit - start)
+    return limit, offset + start
+
 class QueryBuilder:
     def __init__(self, cls):
         self.table = cls._table
         self.conds = []
         self.condfields = []
+        self.joins = []
+        self.order = []
+        self.limit = None
+        self.offset = 0
+
+    def copy(self):
+        qb = QueryBuilder.__new__(QueryBuilder)
+        qb.table = self.table
+        qb.conds = list(self.conds)
+        qb.condfields = list(self.condfields)
+        qb.joins = list(self.joins)
+        qb.order = list(self.order)
+        qb.limit = self.limit
+        qb.offset = self.offset
+        return qb
+
+    def slice(self, start, stop):
+        """narrows the current limit and offset to [start:stop] of the
+        current results"""
+        self.limit, self.offset = _narrow(self.limit, self.offset, start, stop)
     
     def condition(self, field, val):
         if val is None:
@@ -84,7 +627,7 @@ class QueryBuilder:
         if not isinstance(val, Comparison):
             val = Equal(val)
         
-        cond, condfields = val.render(field)
+        cond, condfields = val.render("{}.{}".format(self.table, field))
         self.conds.append(cond)
         self.condfields += condfields
     
@@ -92,24 +635,76 @@ class QueryBuilder:
         for k, v in kwargs.items():
             self.condition(v, locals[k])
     
+    def _render(self, fields):
+        query = "select {} from {}".format(fields, self.table)
+        params = []
+
+        if self.joins:
+            query += " " + " ".join(self.joins)
+
+        if self.conds:
+            query += " where " + " and ".join(self.conds)
+            params += self.condfields
+
+        if self.order:
+            query += " order by " + ", ".join("{}.{}{}".format(self.table, col, " desc" if desc else "") for col, desc in self.order)
+
+        if self.limit is not None or self.offset:
+            query += " limit ? offset ?"
+            params += [-1 if self.limit is None else self.limit, self.offset]
+
+        return query, tuple(params)
+
+    def _explain(self, conn, query, params):
+        for row in conn.execute("explain query plan " + query, params):
+            detail = row[-1]
+            # a scan of a constant row, as in exists(), or of a
+            # subquery's results reads no table
+            if detail.startswith(_HARMLESS_SCANS):
+                continue
+            if detail.startswith("SCAN") and "USING" not in detail:
+                logger.warning("%s in: %s %r", detail, query, params)
+
+    def _execute(self, query, params):
+        cfg = _getcf()
+        if cfg.explain:
+            self._explain(cfg.dbconn, query, params)
+        start = time.monotonic()
+        c = cfg.dbconn.cursor()
+        if params:
+            c.execute(query, params)
+        else:
+            c.execute(query)
+        if instrument.active():
+            return _TimedCursor(c, query, params, time.monotonic() - start)
+        return c
+
     def select(self, *fields):
         if fields:
             fields = ', '.join(fields)
         else:
             fields = '*'
         
-        query = "select rowid, {} from {}".format(fields, self.table)
-        
-        condfields = None
-        if self.conds:
-            conditions = " and ".join(self.conds)
-            condfields = tuple(self.condfields)
-            query += " where " + conditions
-        
-        c = _getcf().dbconn.cursor()
-        if condfields:
-            c.execute(query, condfields)
-        else:
-            c.execute(query)
+        c = self._execute(*self._render("rowid, " + fields))
         for row in c:
             yield dict(zip((i[0] for i in c.description), row))
+
+    def rows(self, *fields):
+        """like select, but yields (column map, values tuple) pairs"""
+        c = self._execute(*self._render("rowid, " + ", ".join(fields)))
+        cmap = _column_map(i[0] for i in c.description)
+        for row in c:
+            yield cmap, row
+
+    def count(self):
+        query, params = self._render("1")
+        c = self._execute("select count(*) from ({})".format(query), params)
+        return c.fetchone()[0]
+
+    def exists(self):
+        query, params = self._render("1")
+        c = self._execute("select exists ({})".format(query), params)
+        return bool(c.fetchone()[0])
+
+# late imports
+from .names import get_name_index
@@ -1,11 +1,12 @@
-from .local import LocalObject, QueryBuilder
-from .cached_property import cached_property
+from .local import LocalObject, QueryBuilder, QuerySet
+from .cached_property import cached_property, prime_cached_property
 from .html import HTMLBuilder
-from .config import _getcf
+from .config import _getcf, _run
 
 __all__ = ['Region', 'Constellation', 'SolarSystem']
 
 class MapObject(LocalObject):
+    __slots__ = ()
     @cached_property
     def position(self):
         return tuple(self._data[k] for k in ['x', 'y', 'z'])
@@ -21,7 +22,13 @@ class MapObject(LocalObject):
         return self._data['radius']    
 
 class Region(MapObject):
+    __slots__ = ()
     _table = 'mapRegions'
+    _fields = {
+        'id': 'regionID',
+        'name': 'regionName',
+        'radius': 'radius',
+    }
     
     @property
     def name(self):
@@ -31,11 +38,11 @@ class Region(MapObject):
     
     @property
     def constellations(self):
-        return Constellation.filter(region=self)
+        return _run(self._cfg, Constellation.filter, region=self)
 
     @property
     def solar_systems(self):
-        return SolarSystem.filter(region=self)
+        return _run(self._cfg, SolarSystem.filter, region=self)
     
     def __repr__(self):
         return "<Region: {}>".format(self.name)
@@ -50,11 +57,17 @@ class Region(MapObject):
                       id = "regionID",
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['regionID'], data=data)
+        return QuerySet(cls, qb)
 
 class Constellation(MapObject):
+    __slots__ = ()
     _table = 'mapConstellations'
+    _fields = {
+        'id': 'constellationID',
+        'name': 'constellationName',
+        'region': 'regionID',
+        'radius': 'radius',
+    }
     
     @property
     def name(self):
@@ -68,7 +81,7 @@ class Constellation(MapObject):
     
     @property
     def solar_systems(self):
-        return SolarSystem.filter(constellation=self)
+        return _run(self._cfg, SolarSystem.filter, constellation=self)
     
     def __repr__(self):
         return "<Constellation: {}/{}>".format(self.region.name, self.name)
@@ -90,11 +103,16 @@ class Constellation(MapObject):
                       id = "constellationID",
         )
         
-        for data in qb.select():
-            yield cls.new_from_id(data['constellationID'], data=data)
+        return QuerySet(cls, qb)
 
 class SolarSystemJumps(LocalObject):
+    __slots__ = ()
     _table = 'mapSolarSystemJumps'
+    _fields = {
+        'id': 'rowid',
+        'from_solar_system': 'fromSolarSystemID',
+        'to_solar_system': 'toSolarSystemID',
+    }
 
     @cached_property
     def from_solar_system(self):
@@ -122,11 +140,28 @@ class SolarSystemJumps(LocalObject):
                       fromid = "fromSolarSystemID",
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['rowid'], data=data)
+        return QuerySet(cls, qb)
 
 class SolarSystem(MapObject):
+    __slots__ = ()
     _table = 'mapSolarSystems'
+    _fields = {
+        'id': 'solarSystemID',
+        'name': 'solarSystemName',
+        'region': 'regionID',
+        'constellation': 'constellationID',
+        'luminosity': 'luminosity',
+        'border': 'border',
+        'fringe': 'fringe',
+        'corridor': 'corridor',
+        'hub': 'hub',
+        'international': 'international',
+        'regional': 'regional',
+        'constellational': 'constellation',
+        'security': 'security',
+        'security_class': 'securityClass',
+        'radius': 'radius',
+    }
     
     @property
     def name(self):
@@ -215,6 +250,56 @@ class SolarSystem(MapObject):
         jumps = SolarSystemJumps.filter(from_solar_system=self)
         return [jump.to_solar_system for jump in jumps]
 
+    @classmethod
+    def _prefetch_jumps(cls, systems):
+        jumps = list(SolarSystemJumps._filter_in('from_solar_system', set(s.id for s in systems)))
+        # keep the destinations alive until they are stored on each system
+        targets = list(cls._filter_in('id', set(j._data['toSolarSystemID'] for j in jumps)))
+        bysystem = dict((s.id, []) for s in systems)
+        for j in jumps:
+            bysystem[j._data['fromSolarSystemID']].append(j.to_solar_system)
+        for s in systems:
+            prime_cached_property(s, 'jumps', bysystem[s.id])
+
+    def route_to(self, other, prefer='shortest'):
+        """returns the list of systems on a route from here to other,
+        inclusive, or None if there is no route. prefer is one of
+        'shortest', 'safer' or 'less_secure'."""
+        if not isinstance(other, SolarSystem):
+            other = SolarSystem(name=other)
+        route = get_jump_graph().route(self.id, other.id, prefer=prefer)
+        if route is None:
+            return None
+        systems = SolarSystem.in_bulk(route)
+        return [systems[id] for id in route]
+
+    def jumps_to(self, other):
+        """returns the number of jumps from here to other, or None if
+        there is no route, using the cached distance matrix"""
+        if not isinstance(other, SolarSystem):
+            other = SolarSystem(name=other)
+        from .distances import get_jump_distances
+        return get_jump_distances().distance(self.id, other.id)
+
+    def distances_from(self, systems):
+        """returns the number of jumps from here to each of systems"""
+        from .distances import get_jump_distances
+        ids = [s.id if isinstance(s, SolarSystem) else s for s in systems]
+        return get_jump_distances().distances(self.id, ids)
+
+    def within_range(self, ly):
+        """returns the systems within ly light years of here, nearest
+        first"""
+        from .spatial import get_spatial_index
+        ids, _ = get_spatial_index().within(self.id, ly)
+        return [SolarSystem.new_from_id(int(id)) for id in ids]
+
+    def nearest(self, k):
+        """returns the k systems nearest to here, nearest first"""
+        from .spatial import get_spatial_index
+        ids, _ = get_spatial_index().nearest(self.id, k)
+        return [SolarSystem.new_from_id(int(id)) for id in ids]
+
     def __repr__(self):
         return "<SolarSystem: {}/{}/{} {:.1f}>".format(self.region.name, self.constellation.name, self.name, self.security)
 
@@ -262,6 +347,13 @@ class SolarSystem(MapObject):
                       security_class = "securityClass"
         )
 
-        for data in qb.select():
-            yield cls.new_from_id(data['solarSystemID'], data=data)
-    
+        return QuerySet(cls, qb)
+
+Constellation._related = {'region': Region}
+SolarSystemJumps._related = {'from_solar_system': SolarSystem, 'to_solar_system': SolarSystem}
+SolarSystem._related = {'region': Region, 'constellation': Constellation}
+
+# late imports
+from .route import get_jump_graph
+# the distance matrix and spatial index (and so multiprocessing and
+# numpy) are imported where they are used, to keep importing cheap
@@ -2,10 +2,10 @@ from .config import _getcf
 from .cached_property import cached_property
 from .map import Region, SolarSystem
 from .items import ItemType
+from .fetch import completed, gather
+from . import instrument
 
 import urllib.parse
-import urllib.request
-import json
 
 __all__ = ['ItemPrice']
 
@@ -23,9 +23,7 @@ class MarketObject:
         raise NotImplementedError("filter")
     
     @classmethod
-    def _fetch(cls, **kwargs):
-        cfg = _getcf()
-
+    def _url_for(cls, cfg, **kwargs):
         params = {}
         for k, v in kwargs.items():
             if not isinstance(v, list):
@@ -33,24 +31,16 @@ class MarketObject:
             params[k] = ','.join(str(i) for i in v)
         params['char_name'] = cfg.charname
         
-        url = cls._url + '?' + urllib.parse.urlencode(params)
-        
-        try:
-            return cfg.marketcache[url]
-        except KeyError:
-            pass
-        
-        with urllib.request.urlopen(url) as f:
-            rstr = f.read().decode()
-            try:
-                result = json.loads(rstr)
-            except ValueError as e:
-                raise RuntimeError(rstr) from e
-        
+        return cls._url + '?' + urllib.parse.urlencode(params)
+    
+    @classmethod
+    def _request(cls, cfg, url):
+        return cls._objects(cfg, cfg.market.rows(url))
+    
+    @classmethod
+    def _objects(cls, cfg, rows):
         results = []
-        for datarow in result['emd']['result']:
-            data = datarow['row']
-            
+        for data in rows:
             obj = super().__new__(cls)
             obj._cfg = cfg
             obj._data = data
@@ -58,12 +48,76 @@ class MarketObject:
             
             results.append(obj)
         
-        cfg.marketcache[url] = results
         return results
+    
+    @classmethod
+    def _cached(cls, cfg, key):
+        """returns (results, fresh) for key, from memory or the disk
+        cache, or raises KeyError. Stale disk entries are returned only if
+        cfg.serve_stale is set, and the caller should then refresh them."""
+        try:
+            results = cfg.marketcache[key]
+        except KeyError:
+            pass
+        else:
+            instrument.emit('marketcache', key=key, hit=True, source='memory')
+            return results, True
+        
+        try:
+            if cfg.diskcache is None:
+                raise KeyError(key)
+            rows, fresh = cfg.diskcache.get(key)
+            if not fresh and not cfg.serve_stale:
+                raise KeyError(key)
+        except KeyError:
+            instrument.emit('marketcache', key=key, hit=False)
+            raise
+        
+        instrument.emit('marketcache', key=key, hit=True, source='disk', fresh=fresh)
+        results = cls._objects(cfg, rows)
+        if fresh:
+            cfg.marketcache[key] = results
+        return results, fresh
+    
+    @classmethod
+    def _store(cls, cfg, key, results):
+        cfg.marketcache[key] = results
+        if cfg.diskcache is not None:
+            cfg.diskcache.set(key, [p._data for p in results])
+    
+    @classmethod
+    def _load(cls, cfg, url):
+        results = cls._request(cfg, url)
+        cls._store(cfg, url, results)
+        return results
+    
+    @classmethod
+    def _submit(cls, **kwargs):
+        """returns a future for the results of a request, sharing any
+        identical request that is already running"""
+        cfg = _getcf()
+        url = cls._url_for(cfg, **kwargs)
+        
+        load = (url, lambda: cls._load(cfg, url))
+        try:
+            results, fresh = cls._cached(cfg, url)
+        except KeyError:
+            return cfg.fetcher.submit(*load)
+        if not fresh:
+            cfg.fetcher.submit(*load)
+        return completed(results)
+    
+    @classmethod
+    def _fetch(cls, **kwargs):
+        return cls._submit(**kwargs).result()
 
 class ItemPrice(MarketObject):
     _url = "http://api.eve-marketdata.com/api/item_prices2.json"
     
+    # the most types and locations asked for in a single request
+    _chunk_types = 100
+    _chunk_locations = 10
+    
     @cached_property
     def type(self):
         return ItemType.new_from_id(int(self._data['typeID']))
@@ -109,6 +163,114 @@ class ItemPrice(MarketObject):
     # FIXME minmax
     @classmethod
     def filter(cls, type=None, region=None, solar_system=None, buysell=None):
+        params = cls._params(type=type, region=region, solar_system=solar_system, buysell=buysell)
+        return cls._finish(cls._submit_split(params).result())
+    
+    @classmethod
+    def frame(cls, type=None, region=None, solar_system=None, buysell=None):
+        """like filter, but returns the prices as a PriceFrame"""
+        from .frame import PriceFrame
+        return PriceFrame.from_rows(p._data for p in cls.filter(type=type, region=region, solar_system=solar_system, buysell=buysell))
+    
+    @classmethod
+    def filter_many(cls, queries):
+        """runs filter for each dict of arguments in queries concurrently,
+        and returns the list of their results"""
+        futures = [cls._submit_split(cls._params(**q)) for q in queries]
+        return [cls._finish(f.result()) for f in futures]
+    
+    @classmethod
+    async def afilter(cls, type=None, region=None, solar_system=None, buysell=None):
+        """a coroutine version of filter"""
+        params = cls._params(type=type, region=region, solar_system=solar_system, buysell=buysell)
+        import asyncio
+        results = await asyncio.wrap_future(cls._submit_split(params))
+        return cls._finish(results)
+    
+    @classmethod
+    def _submit_split(cls, params):
+        """returns a future for the results of a request, split into
+        chunks of types and locations that are fetched in parallel and
+        cached per (type, location) pair, so overlapping requests reuse
+        each other's results"""
+        if 'type_ids' not in params:
+            return cls._submit(**params)
+        
+        cfg = _getcf()
+        buysell = params['buysell']
+        if 'region_ids' in params:
+            kind, field, locs = 'region_ids', 'regionID', params['region_ids']
+        elif 'solarsystem_ids' in params:
+            kind, field, locs = 'solarsystem_ids', 'solarsystemID', params['solarsystem_ids']
+        else:
+            kind, field, locs = None, None, [None]
+        pairs = [(t, l) for t in params['type_ids'] for l in locs]
+        
+        def key(t, l):
+            return (cls._url, t, kind, l, buysell)
+        
+        def request(types, locs):
+            chunk = {'type_ids': list(types), 'buysell': buysell}
+            if kind is not None:
+                chunk[kind] = list(locs)
+            url = cls._url_for(cfg, **chunk)
+            return (url, lambda: cls._load_chunk(cfg, url, types, locs, field, key))
+        
+        def submit(bylocation):
+            # locations needing the same types can share requests
+            bytypes = {}
+            for l, types in bylocation.items():
+                bytypes.setdefault(tuple(sorted(types)), []).append(l)
+            futures = []
+            for types, ls in sorted(bytypes.items(), key=lambda x: x[0]):
+                ls = sorted(ls, key=lambda l: -1 if l is None else l)
+                for i in range(0, len(types), cls._chunk_types):
+                    for j in range(0, len(ls), cls._chunk_locations):
+                        ctypes = types[i:i + cls._chunk_types]
+                        clocs = ls[j:j + cls._chunk_locations]
+                        futures.append(cfg.fetcher.submit(*request(ctypes, clocs)))
+            return futures
+        
+        found = {}
+        missing = {}
+        stale = {}
+        for t, l in pairs:
+            try:
+                found[(t, l)], fresh = cls._cached(cfg, key(t, l))
+            except KeyError:
+                missing.setdefault(l, set()).add(t)
+            else:
+                if not fresh:
+                    stale.setdefault(l, set()).add(t)
+        
+        # stale results are served now, and refreshed in the background
+        submit(stale)
+        futures = submit(missing)
+        
+        def combine(chunks):
+            for chunk in chunks:
+                found.update(chunk)
+            return [p for pair in pairs for p in found[pair]]
+        return gather(futures, combine)
+    
+    @classmethod
+    def _load_chunk(cls, cfg, url, types, locs, field, key):
+        results = dict(((t, l), []) for t in types for l in locs)
+        for p in cls._request(cfg, url):
+            l = None
+            if field is not None:
+                l = int(p._data[field]) if field in p._data else locs[0]
+            results.setdefault((int(p._data['typeID']), l), []).append(p)
+        for (t, l), ps in results.items():
+            cls._store(cfg, key(t, l), ps)
+        return results
+    
+    @classmethod
+    def _finish(cls, results):
+        return [p for p in results if p.price > 0]
+    
+    @classmethod
+    def _params(cls, type=None, region=None, solar_system=None, buysell=None):
         if all([type is None, region is None, solar_system is None]):
             raise ValueError("must provide one of type, region, solar_system")
         
@@ -120,19 +282,19 @@ class ItemPrice(MarketObject):
         if type is not None:
             if not isinstance(type, list):
                 type = [type]
-            type = [t if isinstance(t, ItemType) else ItemType(name=t) for t in type]
+            type = ItemType._resolve(type)
             params['type_ids'] = [t.id for t in type]
         
         if region is not None:
             if not isinstance(region, list):
                 region = [region]
-            region = [r if isinstance(r, Region) else Region(name=r) for r in region]
+            region = Region._resolve(region)
             params['region_ids'] = [r.id for r in region]
         
         if solar_system is not None:
             if not isinstance(solar_system, list):
                 solar_system = [solar_system]
-            solar_system = [s if isinstance(s, SolarSystem) else SolarSystem(name=s) for s in solar_system]
+            solar_system = SolarSystem._resolve(solar_system)
             params['solarsystem_ids'] = [s.id for s in solar_system]
         
         params['buysell'] = 'a'
@@ -145,4 +307,4 @@ class ItemPrice(MarketObject):
             else:
                 params['buysell'] = 's'
         
-        return [p for p in cls._fetch(**params) if p.price > 0]
+        return params
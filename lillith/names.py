@@ -0,0 +1,116 @@
+from .config import _getcf
+
+import bisect
+import collections
+import heapq
+import itertools
+
+__all__ = ['NameIndex']
+
+# fuzzy matches must share at least this fraction of their trigrams
+_MIN_SIMILARITY = 0.3
+# prefix, substring and fuzzy matches considered for ranking, per
+# result asked for
+_PREFIX_CANDIDATES = 20
+_SUBSTRING_CANDIDATES = 20
+_FUZZY_CANDIDATES = 5
+# posting list entries counted to find fuzzy candidates
+_FUZZY_POSTINGS = 2000
+
+def _fold(name):
+    return ' '.join(name.lower().split())
+
+def _trigrams(folded):
+    padded = '  ' + folded + ' '
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class NameIndex:
+    """an in-memory index over the names of one LocalObject class, for
+    ranked exact, prefix, substring and fuzzy (trigram) matching.
+
+    Scores are 4 for exact matches, 3 for prefixes, 2 for substrings and
+    the trigram similarity, between 0 and 1, for fuzzy matches.
+    """
+    def __init__(self, cls):
+        rows = [(v['id'], v['name']) for v in cls.all().values('id', 'name') if v['name']]
+        self.ids = [r[0] for r in rows]
+        self.names = [r[1] for r in rows]
+        self._folded = [_fold(n) for n in self.names]
+        self._sorted = sorted((f, i) for i, f in enumerate(self._folded))
+        self._sortedkeys = [f for f, _ in self._sorted]
+        self._grams = [_trigrams(f) for f in self._folded]
+        postings = collections.defaultdict(list)
+        for i, grams in enumerate(self._grams):
+            for g in grams:
+                postings[g].append(i)
+        self._postings = dict(postings)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _prefixed(self, q):
+        start = bisect.bisect_left(self._sortedkeys, q)
+        for j in range(start, len(self._sorted)):
+            f, i = self._sorted[j]
+            if not f.startswith(q):
+                break
+            yield i
+
+    def _substrings(self, q):
+        # every name containing q, from the names that share q's rarest
+        # inner trigram, or from all names if q is too short for one
+        inner = set(q[i:i + 3] for i in range(len(q) - 2))
+        if inner:
+            candidates = min((self._postings.get(g, ()) for g in inner), key=len)
+        else:
+            candidates = range(len(self.ids))
+        for i in candidates:
+            if q in self._folded[i]:
+                yield i
+
+    def _fuzzy(self, q, limit):
+        # yields (index, similarity) for the names sharing the most of
+        # q's rarer trigrams; the common ones match most of the index, so
+        # only up to _FUZZY_POSTINGS entries are counted
+        grams = _trigrams(q)
+        postings = sorted((self._postings.get(g, ()) for g in grams), key=len)
+        hits = collections.Counter()
+        counted = 0
+        for p in postings:
+            if counted + len(p) > _FUZZY_POSTINGS and hits:
+                break
+            hits.update(p)
+            counted += len(p)
+        for i, _ in hits.most_common(limit * _FUZZY_CANDIDATES):
+            n = len(grams & self._grams[i])
+            similarity = n / (len(grams) + len(self._grams[i]) - n)
+            if similarity >= _MIN_SIMILARITY:
+                yield i, similarity
+
+    def search(self, text, limit=10):
+        """returns up to limit (id, score) pairs for text, best first"""
+        q = _fold(text)
+        if not q:
+            return []
+        scores = {}
+        for i in itertools.islice(self._prefixed(q), limit * _PREFIX_CANDIDATES):
+            scores[i] = 4 if self._folded[i] == q else 3
+
+        if len(scores) < limit:
+            substrings = (i for i in self._substrings(q) if i not in scores)
+            for i in itertools.islice(substrings, limit * _SUBSTRING_CANDIDATES):
+                scores[i] = 2
+
+        if len(scores) < limit:
+            for i, similarity in self._fuzzy(q, limit):
+                scores.setdefault(i, similarity)
+
+        best = heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], len(self._folded[x[0]]), self._folded[x[0]]))
+        return [(self.ids[i], score) for i, score in best]
+
+def get_name_index(cls):
+    cfg = _getcf()
+    try:
+        return cfg.nameindexes[cls]
+    except KeyError:
+        return cfg.nameindexes.setdefault(cls, NameIndex(cls))
@@ -0,0 +1,72 @@
+from .local import QueryBuilder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Reprocessor']
+
+def _ids(things):
+    return [getattr(t, 'id', t) for t in things]
+
+class Reprocessor:
+    """the whole of invTypeMaterials as a sparse type x material matrix,
+    for valuing reprocessing of every type at once.
+
+    Row i of the matrix is type_ids[i], column j is material_ids[j]; the
+    non-zero entries are stored as parallel rows/cols/quantity arrays.
+    """
+    def __init__(self):
+        if numpy is None:
+            raise RuntimeError("numpy is required for reprocessing")
+
+        data = list(QueryBuilder(ItemTypeMaterial).select('typeID', 'materialTypeID', 'quantity'))
+        types = numpy.array([d['typeID'] for d in data], dtype=numpy.int64)
+        mats = numpy.array([d['materialTypeID'] for d in data], dtype=numpy.int64)
+        self.quantity = numpy.array([d['quantity'] for d in data], dtype=numpy.float64)
+        self.type_ids, self.rows = numpy.unique(types, return_inverse=True)
+        self.material_ids, self.cols = numpy.unique(mats, return_inverse=True)
+
+        portions = dict((d['typeID'], d['portionSize']) for d in QueryBuilder(ItemType).select('typeID', 'portionSize'))
+        self.portion_size = numpy.array([portions.get(t) or 1 for t in self.type_ids.tolist()], dtype=numpy.float64)
+
+    def _vector(self, prices, ids):
+        # prices is a dict keyed by type or type ID; missing ones are 0
+        prices = dict((getattr(k, 'id', k), v) for k, v in prices.items())
+        return numpy.array([prices.get(i, 0.0) for i in ids.tolist()], dtype=numpy.float64)
+
+    def values(self, prices, yield_=0.5, efficiency=1.0):
+        """returns the value of reprocessing one unit of each of type_ids,
+        given material prices. Each batch yields floor(quantity * yield_)
+        of every material, and the resulting value is scaled by
+        efficiency (for example, 1 - tax)."""
+        pv = self._vector(prices, self.material_ids)
+        batch = numpy.floor(self.quantity * yield_) * pv[self.cols]
+        value = numpy.bincount(self.rows, weights=batch, minlength=len(self.type_ids))
+        return value * efficiency / self.portion_size
+
+    def top(self, prices, sell_prices, n=20, yield_=0.5, efficiency=1.0):
+        """returns up to n (type, reprocess value, sell price) tuples for
+        the types worth more reprocessed than sold, best margin first.
+        Types with no sell price are skipped."""
+        value = self.values(prices, yield_=yield_, efficiency=efficiency)
+        sell = self._vector(sell_prices, self.type_ids)
+        margin = value - sell
+        candidates = numpy.nonzero((sell > 0) & (margin > 0))[0]
+        best = candidates[numpy.argsort(-margin[candidates], kind='stable')[:n]]
+        types = ItemType.in_bulk(self.type_ids[best].tolist())
+        return [(types[t], v, s) for t, v, s in zip(self.type_ids[best].tolist(), value[best].tolist(), sell[best].tolist())]
+
+    @staticmethod
+    def market_prices(types, buysell='buy', **kwargs):
+        """returns a dict of the best buysell price of each of types, as
+        found by ItemPrice.frame(**kwargs). Pass region or solar_system."""
+        frame = ItemPrice.frame(type=_ids(types), buysell=buysell, **kwargs)
+        best = frame.best(by=('type_id',))
+        column = best['best_buy'] if buysell == 'buy' else best['best_sell']
+        return dict((t, p) for t, p in zip(best['type_id'].tolist(), column.tolist()) if p == p)
+
+# late imports
+from .items import ItemType, ItemTypeMaterial
+from .market import ItemPrice
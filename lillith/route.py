@@ -0,0 +1,123 @@
+from .local import QueryBuilder
+from .config import _getcf
+
+import array
+import heapq
+
+__all__ = ['JumpGraph']
+
+# cost of entering a system the route would rather avoid; large enough
+# that any detour through preferred space is taken first
+_AVOID_COST = 10000
+
+class JumpGraph:
+    """an in-memory index of the stargate network, stored as CSR arrays
+
+    Systems are numbered densely in order of their ID; the neighbours
+    of system i are targets[offsets[i]:offsets[i + 1]].
+    """
+    def __init__(self):
+        systems = sorted((data['solarSystemID'], data['security']) for data in QueryBuilder(SolarSystem).select('solarSystemID', 'security'))
+        self.ids = array.array('q', (s[0] for s in systems))
+        self.security = array.array('d', (s[1] for s in systems))
+        self._index = dict((id, i) for i, id in enumerate(self.ids))
+
+        edges = []
+        for data in QueryBuilder(SolarSystemJumps).select('fromSolarSystemID', 'toSolarSystemID'):
+            try:
+                edges.append((self._index[data['fromSolarSystemID']], self._index[data['toSolarSystemID']]))
+            except KeyError:
+                continue
+        edges.sort()
+
+        self.offsets = array.array('l', [0] * (len(self.ids) + 1))
+        for a, _ in edges:
+            self.offsets[a + 1] += 1
+        for i in range(len(self.ids)):
+            self.offsets[i + 1] += self.offsets[i]
+        self.targets = array.array('l', (b for _, b in edges))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, id):
+        try:
+            return self._index[id]
+        except KeyError:
+            raise ValueError("unknown solar system: {}".format(id)) from None
+
+    def neighbours(self, id):
+        i = self.index(id)
+        return [self.ids[j] for j in self.targets[self.offsets[i]:self.offsets[i + 1]]]
+
+    def _costs(self, prefer):
+        if prefer == 'shortest':
+            return None
+        if prefer == 'safer':
+            return [1 if round(s, 1) >= 0.5 else _AVOID_COST for s in self.security]
+        if prefer == 'less_secure':
+            return [_AVOID_COST if round(s, 1) >= 0.5 else 1 for s in self.security]
+        raise ValueError("invalid value for prefer: {}".format(prefer))
+
+    def _bfs(self, start, end):
+        offsets, targets = self.offsets, self.targets
+        parents = {start: None}
+        frontier = [start]
+        while frontier and end not in parents:
+            nextfrontier = []
+            for a in frontier:
+                for b in targets[offsets[a]:offsets[a + 1]]:
+                    if b not in parents:
+                        parents[b] = a
+                        nextfrontier.append(b)
+            frontier = nextfrontier
+        return parents
+
+    def _dijkstra(self, start, end, costs):
+        offsets, targets = self.offsets, self.targets
+        parents = {start: None}
+        dist = {start: 0}
+        heap = [(0, start)]
+        while heap:
+            d, a = heapq.heappop(heap)
+            if a == end:
+                break
+            if d > dist[a]:
+                continue
+            for b in targets[offsets[a]:offsets[a + 1]]:
+                nd = d + costs[b]
+                if nd < dist.get(b, nd + 1):
+                    dist[b] = nd
+                    parents[b] = a
+                    heapq.heappush(heap, (nd, b))
+        return parents
+
+    def route(self, from_id, to_id, prefer='shortest'):
+        """returns the list of system IDs from from_id to to_id, inclusive,
+        or None if there is no route"""
+        start = self.index(from_id)
+        end = self.index(to_id)
+        costs = self._costs(prefer)
+        if costs is None:
+            parents = self._bfs(start, end)
+        else:
+            parents = self._dijkstra(start, end, costs)
+
+        if end not in parents:
+            return None
+        path = []
+        i = end
+        while i is not None:
+            path.append(self.ids[i])
+            i = parents[i]
+        path.reverse()
+        return path
+
+def get_jump_graph():
+    cfg = _getcf()
+    if cfg.jumpgraph is None:
+        cfg.jumpgraph = JumpGraph()
+    return cfg.jumpgraph
+
+# late imports
+from .map import SolarSystem, SolarSystemJumps
@@ -0,0 +1,95 @@
+from .local import QueryBuilder
+from .config import _getcf
+
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['SpatialIndex', 'LIGHT_YEAR']
+
+# metres, the unit of the SDE coordinates
+LIGHT_YEAR = 9460730472580800
+
+class SpatialIndex:
+    """a uniform grid over solar system positions, for range and
+    nearest-neighbour queries. Distances are in light years.
+    """
+    def __init__(self, cellsize=5):
+        if numpy is None:
+            raise RuntimeError("numpy is required for spatial queries")
+
+        rows = [(data['solarSystemID'], data['x'], data['y'], data['z']) for data in QueryBuilder(SolarSystem).select('solarSystemID', 'x', 'y', 'z')]
+        rows.sort()
+        self.ids = numpy.array([r[0] for r in rows], dtype=numpy.int64)
+        self.positions = numpy.array([r[1:] for r in rows], dtype=numpy.float64).reshape(-1, 3) / LIGHT_YEAR
+        self._index = dict((id, i) for i, id in enumerate(self.ids.tolist()))
+
+        self.cellsize = cellsize
+        cells = numpy.floor(self.positions / cellsize).astype(numpy.int64)
+        order = numpy.lexsort(cells.T[::-1])
+        keys = [tuple(c) for c in cells[order].tolist()]
+        self._cells = {}
+        for key, group in itertools.groupby(range(len(order)), key=lambda i: keys[i]):
+            group = list(group)
+            self._cells[key] = order[group[0]:group[-1] + 1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, id):
+        try:
+            return self.positions[self._index[id]]
+        except KeyError:
+            raise ValueError("unknown solar system: {}".format(id)) from None
+
+    def _candidates(self, center, radius):
+        lo = numpy.floor((center - radius) / self.cellsize).astype(numpy.int64)
+        hi = numpy.floor((center + radius) / self.cellsize).astype(numpy.int64)
+        ncells = int(numpy.prod(hi - lo + 1))
+        if ncells >= len(self._cells):
+            return numpy.arange(len(self.ids))
+        found = []
+        for key in itertools.product(*(range(a, b + 1) for a, b in zip(lo.tolist(), hi.tolist()))):
+            try:
+                found.append(self._cells[key])
+            except KeyError:
+                pass
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate(found)
+
+    def within(self, id, radius):
+        """returns (ids, distances) of systems within radius of id,
+        nearest first, not including id itself"""
+        center = self.position(id)
+        candidates = self._candidates(center, radius)
+        dist = numpy.sqrt(((self.positions[candidates] - center) ** 2).sum(axis=1))
+        mask = (dist <= radius) & (self.ids[candidates] != id)
+        candidates, dist = candidates[mask], dist[mask]
+        order = numpy.argsort(dist, kind='stable')
+        return self.ids[candidates[order]], dist[order]
+
+    def nearest(self, id, k):
+        """returns (ids, distances) of the k systems nearest to id, not
+        including id itself"""
+        center = self.position(id)
+        dist = numpy.sqrt(((self.positions - center) ** 2).sum(axis=1))
+        dist[self._index[id]] = numpy.inf
+        k = min(k, len(self.ids) - 1)
+        if k <= 0:
+            return self.ids[:0], dist[:0]
+        nearest = numpy.argpartition(dist, k - 1)[:k]
+        nearest = nearest[numpy.argsort(dist[nearest], kind='stable')]
+        return self.ids[nearest], dist[nearest]
+
+def get_spatial_index():
+    cfg = _getcf()
+    if cfg.spatialindex is None:
+        cfg.spatialindex = SpatialIndex()
+    return cfg.spatialindex
+
+# late imports
+from .map import SolarSystem
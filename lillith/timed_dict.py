@@ -1,40 +1,116 @@
+import collections
+import sys
 import time
+import threading
 
 __all__ = ['TimedDict']
 
 monotonic = getattr(time, 'monotonic', time.time)
 
 class TimedDict(dict):
-    def __init__(self, dict={}, time=60, monotonic=monotonic, missing=None):
-        self.expires = {}
+    """a dict whose items expire a fixed time after they are set.
+
+    Because every item lives for the same time, expiry order is insertion
+    order, so only the items that have actually expired are visited. If
+    max_entries or max_bytes is given, the least recently used items are
+    evicted to stay within them; sizes are measured with sizeof.
+    """
+    def __init__(self, dict={}, time=60, monotonic=monotonic, missing=None, max_entries=None, max_bytes=None, sizeof=sys.getsizeof):
+        # key -> deadline, soonest first
+        self.expires = collections.OrderedDict()
         self.missing = missing
         self.time = time
         self.monotonic = monotonic
-        super().__init__(dict)
-    
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.RLock()
+        super().__init__()
+        for k, v in dict.items():
+            self[k] = v
+
+    @property
+    def _bounded(self):
+        return self.max_entries is not None or self.max_bytes is not None
+
+    def _remove(self, key):
+        super().__delitem__(key)
+        del self.expires[key]
+        self.nbytes -= self._sizes.pop(key, 0)
+
     def _expire_items(self):
         current = self.monotonic()
-        for k, v in list(self.expires.items()):
-            if current > v:
-                super().__delitem__(k)
-                del self.expires[k]
-    
+        with self._lock:
+            while self.expires:
+                k, deadline = next(iter(self.expires.items()))
+                if current <= deadline:
+                    break
+                self._remove(k)
+                self.expirations += 1
+
+    def _evict_items(self):
+        # the dict itself is kept in least-recently-used order
+        while len(self) and ((self.max_entries is not None and len(self) > self.max_entries) or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self._remove(next(iter(self)))
+            self.evictions += 1
+
     def __missing__(self, key):
         if not self.missing:
             raise KeyError(key)
         return self.missing(key)
-    
+
     def __getitem__(self, key):
-        self._expire_items()
-        return super().__getitem__(key)
-    
+        with self._lock:
+            self._expire_items()
+            if super().__contains__(key):
+                self.hits += 1
+                item = super().__getitem__(key)
+                if self._bounded:
+                    super().__delitem__(key)
+                    super().__setitem__(key, item)
+                return item
+            self.misses += 1
+        return self.__missing__(key)
+
     def __setitem__(self, key, item):
-        self._expire_items()
-        super().__setitem__(key, item)
-        self.expires[key] = self.monotonic() + self.time
-    
+        with self._lock:
+            self._expire_items()
+            if super().__contains__(key):
+                self._remove(key)
+            super().__setitem__(key, item)
+            self.expires[key] = self.monotonic() + self.time
+            if self.max_bytes is not None:
+                size = self.sizeof(item)
+                self._sizes[key] = size
+                self.nbytes += size
+            if self._bounded:
+                self._evict_items()
+
     def __delitem__(self, key):
-        self._expire_items()
-        super().__delitem__(key)
-        del self.expires[key]
+        with self._lock:
+            self._expire_items()
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.expires.clear()
+            self._sizes.clear()
+            self.nbytes = 0
 
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,120 @@
+import collections
+import http.client
+import threading
+import time
+import urllib.parse
+import zlib
+
+from . import instrument
+
+__all__ = ['HTTPTransport']
+
+RequestStats = collections.namedtuple('RequestStats', ['url', 'status', 'bytes', 'wire_bytes', 'seconds'])
+
+class HTTPTransport:
+    """a minimal HTTP client that keeps connections to each host alive
+    between requests and asks for gzip-compressed responses.
+
+    The timing of recent requests is kept in self.history.
+    """
+    _chunksize = 64 * 1024
+
+    def __init__(self, maxsize=8, timeout=30, history=1000):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.history = collections.deque(maxlen=history)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, scheme, netloc):
+        with self._lock:
+            try:
+                return self._idle[(scheme, netloc)].pop(), True
+            except (KeyError, IndexError):
+                pass
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        if scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+        raise ValueError("unsupported URL scheme: {}".format(scheme))
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def stream(self, url):
+        """yields the body of url in decompressed chunks as they arrive"""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+            'User-Agent': 'lillith',
+        }
+
+        start = time.monotonic()
+        while True:
+            conn, reused = self._acquire(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # the server may have closed an idle connection; retry
+                # those once on a fresh one
+                if reused:
+                    continue
+                raise
+            break
+
+        size = wire = 0
+        done = False
+        try:
+            decoder = None
+            if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while True:
+                chunk = resp.read(self._chunksize)
+                if not chunk:
+                    break
+                wire += len(chunk)
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                size += len(chunk)
+                # error bodies are read, so the connection can be reused
+                if chunk and resp.status == 200:
+                    yield chunk
+            if decoder:
+                chunk = decoder.flush()
+                size += len(chunk)
+                if chunk and resp.status == 200:
+                    yield chunk
+            done = True
+        finally:
+            if done and not resp.will_close:
+                self._release(parts.scheme, parts.netloc, conn)
+            else:
+                conn.close()
+
+        stats = RequestStats(url, resp.status, size, wire, time.monotonic() - start)
+        self.history.append(stats)
+        instrument.emit('fetch', **stats._asdict())
+        if resp.status != 200:
+            raise RuntimeError("HTTP {} {} for {}".format(resp.status, resp.reason, url))
+
+    def get(self, url):
+        """returns the body of url, decompressed"""
+        return b''.join(self.stream(url))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
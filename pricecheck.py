@@ -1,4 +1,8 @@
 import lillith
+import argparse
+import concurrent.futures
+import csv
+import json
 import sys
 import math
 
@@ -22,33 +26,156 @@ def niceisk(n, sigfigs=3):
         n = int(n)
     return "{} {}".format(n, units[unit])
 
+def lookup(name, *classes):
+    """returns the best match for name among classes, or None"""
+    # an exact match avoids building the name indexes
+    for cls in classes:
+        matches = list(cls.filter(name=lillith.Like(name))[:2])
+        if len(matches) == 1:
+            return matches[0]
+    
+    best = None
+    for cls in classes:
+        for obj, score in cls.search(name, limit=1, scores=True):
+            if best is None or score > best[1]:
+                best = (obj, score)
+    if best is None:
+        return None
+    if best[0].name.lower() != name.lower():
+        print("using {}".format(best[0].name), file=sys.stderr)
+    return best[0]
+
+def lookup_many(names, *classes):
+    """returns a dict mapping each of names to its best match among
+    classes, or None, looking up exact names in bulk first"""
+    found = {}
+    names = set(names)
+    for cls in classes:
+        missing = sorted(names - set(found))
+        for i in range(0, len(missing), 500):
+            for obj in cls.filter(name=lillith.In(missing[i:i + 500])):
+                found.setdefault(obj.name, obj)
+    for name in names - set(found):
+        found[name] = lookup(name, *classes)
+    return found
+
+# the columns of a batch result
+FIELDS = ['place', 'item', 'best_buy', 'best_sell', 'spread', 'buy_per_m3', 'sell_per_m3', 'orders']
+
+def summarize(job):
+    """computes a batch result from (place, item, volume, prices), where
+    prices is a list of (buysell, price)"""
+    place, item, volume, prices = job
+    buys = [p for bs, p in prices if bs == 'buy']
+    sells = [p for bs, p in prices if bs == 'sell']
+    best_buy = max(buys) if buys else None
+    best_sell = min(sells) if sells else None
+    result = dict.fromkeys(FIELDS)
+    result.update(place=place, item=item, best_buy=best_buy, best_sell=best_sell, orders=len(prices))
+    if best_buy is not None and best_sell is not None:
+        result['spread'] = best_sell - best_buy
+    if volume:
+        if best_buy is not None:
+            result['buy_per_m3'] = best_buy / volume
+        if best_sell is not None:
+            result['sell_per_m3'] = best_sell / volume
+    return result
+
+def batch_jobs(pairs):
+    """yields a summarize job for each (place, item) name pair that
+    resolves, fetching the prices for all of them concurrently"""
+    places = lookup_many([p for p, _ in pairs], lillith.SolarSystem, lillith.Region)
+    items = lookup_many([i for _, i in pairs], lillith.ItemType)
+
+    # one query per place, for every item asked about there
+    byplace = {}
+    for placename, itemname in pairs:
+        if places[placename] is None:
+            print("invalid place: {}".format(placename), file=sys.stderr)
+        elif items[itemname] is None:
+            print("invalid item: {}".format(itemname), file=sys.stderr)
+        else:
+            byplace.setdefault(places[placename], set()).add(items[itemname])
+    queries = []
+    for place, types in byplace.items():
+        kind = 'solar_system' if isinstance(place, lillith.SolarSystem) else 'region'
+        queries.append({kind: place, 'type': list(types)})
+    prices = {}
+    for place, results in zip(byplace, lillith.ItemPrice.filter_many(queries)):
+        for price in results:
+            prices.setdefault((place, price.type), []).append((price.buysell, price.price))
+
+    for placename, itemname in pairs:
+        place, item = places[placename], items[itemname]
+        if place is not None and item is not None:
+            yield (place.name, item.name, item.volume, prices.get((place, item), []))
+
+def batch(lines, out, format='csv', processes=None, blocksize=1000):
+    """reads (place, item) pairs, one per CSV line, from lines, and
+    writes a result for each to out as it is ready"""
+    if format == 'csv':
+        writer = csv.DictWriter(out, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(result):
+            out.write(json.dumps(result) + '\n')
+
+    def read_pairs():
+        for row in csv.reader(lines):
+            if not row or row[0].startswith('#'):
+                continue
+            if len(row) < 2 or not row[1].strip():
+                print("invalid line, expected place,item: {}".format(','.join(row)), file=sys.stderr)
+                continue
+            yield (row[0].strip(), row[1].strip())
+    pairs = read_pairs()
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        while True:
+            block = [pair for _, pair in zip(range(blocksize), pairs)]
+            if not block:
+                break
+            for result in pool.map(summarize, batch_jobs(block), chunksize=64):
+                write(result)
+            out.flush()
+
 if __name__ == '__main__':
-    lillith.initialize(db, charname)
-    if len(sys.argv) > 3 or len(sys.argv) <= 1:
-        print("usage: {} <system/region> [item]".format(sys.argv[0]), file=sys.stderr)
+    parser = argparse.ArgumentParser(description="check market prices at a system or region")
+    parser.add_argument('place', nargs='?', help="a system or region")
+    parser.add_argument('item', nargs='?')
+    parser.add_argument('--batch', metavar='FILE', help="read place,item lines from FILE, or - for stdin")
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help="batch output format")
+    parser.add_argument('--processes', type=int, help="batch worker processes")
+    args = parser.parse_args()
+    if (args.batch is None) == (args.place is None):
+        parser.print_usage(sys.stderr)
         sys.exit(1)
     
-    place = sys.argv[1]
+    lillith.initialize(db, charname)
+    if args.batch is not None:
+        lines = sys.stdin if args.batch == '-' else open(args.batch, newline='')
+        with lines:
+            batch(lines, sys.stdout, format=args.format, processes=args.processes)
+        sys.exit(0)
+    
     item = None
-    if len(sys.argv) == 3:
-        item = sys.argv[2]
-        try:
-            item = lillith.ItemType(name=lillith.Like(item))
-        except ValueError:
-            print("invalid item: {}".format(item), file=sys.stderr)
+    if args.item is not None:
+        item = lookup(args.item, lillith.ItemType)
+        if item is None:
+            print("invalid item: {}".format(args.item), file=sys.stderr)
             sys.exit(1)
     
-    try:
-        placename = place
-        place = lillith.SolarSystem(name=lillith.Like(placename))
+    place = lookup(args.place, lillith.SolarSystem, lillith.Region)
+    if place is None:
+        print("invalid place: {}".format(args.place), file=sys.stderr)
+        sys.exit(1)
+    if isinstance(place, lillith.SolarSystem):
         prices = lillith.ItemPrice.filter(solar_system=place, type=item)
-    except ValueError:
-        try:
-            place = lillith.Region(name=lillith.Like(placename))
-            prices = lillith.ItemPrice.filter(region=place, type=item)
-        except ValueError:
-            print("invalid place: {}".format(placename), file=sys.stderr)
-            sys.exit(1)
+    else:
+        prices = lillith.ItemPrice.filter(region=place, type=item)
     
     for price in prices:
-        print("{} {}: {} ({}/m^3)".format(price.type.name, price.buysell, niceisk(price.price), niceisk(price.price / item.volume)))
+        # without an item, prices are for every type at the place
+        volume = price.type.volume
+        permeter = niceisk(price.price / volume) if volume else "-"
+        print("{} {}: {} ({}/m^3)".format(price.type.name, price.buysell, niceisk(price.price), permeter))